@@ -0,0 +1,60 @@
+"""
+Wall clock time until the validation RMSE reaches a target, for ALS sweeps
+against SGD epochs on the same synthetic data.
+
+Run from the src directory: ``python -m benchmarks.als_vs_sgd [target]``
+"""
+import sys
+
+import numpy as np
+
+from recsys import RatingMatrix, RecSys
+from benchmarks.synthetic import synthetic_users
+
+
+def make_model(rm, seed=0):
+    np.random.seed(seed)
+    model = RecSys(rm, nfactors=50, lr=0.005, reg=0.05)
+    model.set_testset(0.1)
+    model.initialize()
+    return model
+
+
+def run(name, step, model, target, max_steps):
+    elapsed = 0
+    for i in range(1, max_steps + 1):
+        elapsed += step(model)
+        rmse = model.validate(verbose=False)[0]
+        print("{} {:3d}  {:8.2f}s  rmse {:.4f}".format(name, i, elapsed, rmse))
+        if rmse <= target:
+            print("{} reached rmse {} after {:.2f}s".format(name, target, elapsed))
+            return elapsed
+    print("{} did not reach rmse {} in {} steps".format(name, target, max_steps))
+
+
+def main(target=1.2):
+    rm = RatingMatrix()
+    for username, data in synthetic_users(3000, 10000, 300):
+        rm.add_user_data(username, data)
+
+    # compile the SGD kernel outside the timings
+    make_model(rm).train(epochs=1, verbose=False)
+
+    run(
+        "als",
+        lambda m: m.train_als(sweeps=1, verbose=False),
+        make_model(rm),
+        target,
+        30,
+    )
+    run(
+        "sgd",
+        lambda m: m.train(epochs=5, shuffle=True, verbose=False),
+        make_model(rm),
+        target,
+        100,
+    )
+
+
+if __name__ == "__main__":
+    main(*(float(x) for x in sys.argv[1:]))
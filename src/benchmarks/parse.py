@@ -0,0 +1,93 @@
+"""
+Parsing time of films list pages with the lxml parser compared to the
+BeautifulSoup parser it replaced, and a check that both give the same
+ratings.
+
+Run from the src directory: ``python -m benchmarks.parse [DIRECTORY]``
+DIRECTORY holds saved films list pages (*.html); without it synthetic
+pages with 72 films each are used.
+"""
+import os
+import random
+import sys
+from timeit import default_timer
+
+from bs4 import BeautifulSoup
+
+from letterboxd_scrape.parse import parse_page, parse_ratings
+
+
+def soup_ratings(content):
+    # the parser of letterboxd_scrape before the lxml version
+    soup = BeautifulSoup(content, "lxml")
+    poster_containers = soup.select("li.poster-container")
+    ratings = {}
+    for pc in poster_containers:
+        film_link = pc.select("div.poster")[0]["data-target-link"].split("/")[2]
+        rating_element = pc.select("span.rating")
+        if not rating_element:
+            continue
+        rating = int(rating_element[0]["class"][3].split("-")[1])
+        ratings[film_link] = rating
+    return ratings
+
+
+def synthetic_page(seed, nfilms=72):
+    rng = random.Random(seed)
+    items = []
+    for i in range(nfilms):
+        rating = rng.choice([None] + list(range(1, 11)))
+        span = (
+            '<span class="rating rated-large -micro rated-{}">'
+            "&#9733;&#9733;&#9733;</span>".format(rating)
+            if rating
+            else ""
+        )
+        items.append(
+            '<li class="poster-container"><div class="really-lazy-load poster '
+            'film-poster film-poster-{0}" data-film-id="{0}" data-film-slug='
+            '"film-{1}-{0}" data-target-link="/film/film-{1}-{0}/"><img src='
+            '"empty-poster.png" class="image" width="70" height="105" alt='
+            '"Film {0}"/><span class="frame"><span class="frame-title"></span>'
+            '</span></div><p class="poster-viewingdata">{2}</p></li>'.format(
+                i, seed, span
+            )
+        )
+    return (
+        '<html><head><title>Films</title></head><body class="films-watched">'
+        '<div id="content"><ul class="poster-list -p70 -grid">{}</ul>'
+        '<div class="pagination"><div class="paginate-pages"><ul>'
+        '<li class="paginate-page"><a href="/user/films/page/2/">2</a></li>'
+        "</ul></div></div></div></body></html>".format("".join(items))
+    ).encode("utf-8")
+
+
+def load_pages(directory=None):
+    if directory is None:
+        return [synthetic_page(seed) for seed in range(200)]
+    pages = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".html"):
+            with open(os.path.join(directory, filename), "rb") as f:
+                pages.append(f.read())
+    return pages
+
+
+def measure(parse, pages):
+    start = default_timer()
+    results = [parse(page) for page in pages]
+    return default_timer() - start, results
+
+
+def main(directory=None):
+    pages = load_pages(directory)
+    soup_time, expected = measure(soup_ratings, pages)
+    lxml_time, results = measure(lambda page: parse_ratings(parse_page(page)), pages)
+    same = all(list(a.items()) == list(b.items()) for a, b in zip(expected, results))
+    print("{} pages, identical output: {}".format(len(pages), same))
+    print("beautifulsoup  {:8.2f} ms/page".format(1000 * soup_time / len(pages)))
+    print("lxml           {:8.2f} ms/page".format(1000 * lxml_time / len(pages)))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
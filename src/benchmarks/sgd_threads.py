@@ -0,0 +1,56 @@
+"""
+Throughput of the Hogwild SGD kernel for 1..N threads and its validation
+RMSE compared to the serial kernel.
+
+Run from the src directory: ``python -m benchmarks.sgd_threads [epochs]``
+"""
+import sys
+
+import numba
+import numpy as np
+
+from recsys import RatingMatrix, RecSys
+from benchmarks.synthetic import synthetic_users
+
+
+def make_model(rm, seed=0):
+    np.random.seed(seed)
+    model = RecSys(rm, nfactors=50, lr=0.005)
+    model.set_testset(0.1)
+    model.initialize()
+    return model
+
+
+def main(epochs=10):
+    rm = RatingMatrix()
+    for username, data in synthetic_users(3000, 10000, 300):
+        rm.add_user_data(username, data)
+    nratings = make_model(rm).numpy_trainset().shape[0]
+
+    # compile both kernels outside the timings
+    make_model(rm).train(epochs=1, verbose=False)
+    make_model(rm).train(epochs=1, verbose=False, parallel=True, threads=1)
+
+    model = make_model(rm)
+    seconds = model.train(epochs=epochs, verbose=False)
+    rmse = model.validate(verbose=False)[0]
+    print(
+        "serial      {:12.0f} ratings/s   rmse {:.4f}".format(
+            epochs * nratings / seconds, rmse
+        )
+    )
+    for threads in range(1, numba.config.NUMBA_NUM_THREADS + 1):
+        model = make_model(rm)
+        seconds = model.train(
+            epochs=epochs, verbose=False, parallel=True, threads=threads
+        )
+        rmse = model.validate(verbose=False)[0]
+        print(
+            "{:2d} threads  {:12.0f} ratings/s   rmse {:.4f}".format(
+                threads, epochs * nratings / seconds, rmse
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -0,0 +1,52 @@
+"""
+Import time of recsys and myapp and latency of the first recommendation in
+a fresh interpreter, with an empty and with a filled numba cache.
+
+Run from the src directory, next to model.json or model.bin:
+``python -m benchmarks.startup``
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import json, time
+t = time.perf_counter()
+import recsys
+recsys.RatingMatrix
+rm = time.perf_counter() - t
+t = time.perf_counter()
+import myapp
+app = time.perf_counter() - t
+times = []
+for _ in range(2):
+    t = time.perf_counter()
+    myapp.warm_up()
+    times.append(time.perf_counter() - t)
+print(json.dumps([rm, app] + times))
+"""
+
+
+def probe(cache_dir):
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], env=env, capture_output=True, check=True
+    ).stdout
+    return json.loads(out.decode().splitlines()[-1])
+
+
+def main():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for label in ("empty numba cache", "filled numba cache"):
+            rm, app, first, second = probe(cache_dir)
+            print(label)
+            print("    import RatingMatrix  {:8.3f}s".format(rm))
+            print("    import myapp         {:8.3f}s".format(app))
+            print("    first request        {:8.3f}s".format(first))
+            print("    second request       {:8.3f}s".format(second))
+
+
+if __name__ == "__main__":
+    main()
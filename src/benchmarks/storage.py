@@ -0,0 +1,107 @@
+"""
+Memory and throughput of the array-backed RatingMatrix compared to the
+dict-of-dicts layout it replaced (``_data[uid][mid]`` plus ``_ratedby`` lists).
+
+Run from the src directory: ``python -m benchmarks.storage``
+"""
+import sys
+import tracemalloc
+from timeit import default_timer
+
+import numpy as np
+
+from recsys import RatingMatrix, RecSys
+from benchmarks.synthetic import synthetic_users
+
+
+class DictRatings:
+    # the storage layout of RatingMatrix before it was array-backed
+    def __init__(self):
+        self._data = {}
+        self._ratedby = {}
+        self._uid = {}
+        self._mid = {}
+
+    def add_user_data(self, username, data):
+        uid = self._uid.setdefault(username, len(self._uid))
+        for movie, rating in data.items():
+            mid = self._mid.setdefault(movie, len(self._mid))
+            self._ratedby.setdefault(mid, []).append(uid)
+            self._data.setdefault(uid, {})[mid] = rating
+
+    def global_mean(self):
+        gm, i = 0, 0
+        for d in self._data.values():
+            for r in d.values():
+                gm += r
+                i += 1
+        return gm / i
+
+    def votes(self):
+        return {mid: len(uids) for mid, uids in self._ratedby.items()}
+
+    def trainset(self):
+        return np.array(
+            [(u, m, r) for u, d in self._data.items() for m, r in d.items()]
+        )
+
+
+def measure(name, build, ops):
+    tracemalloc.start()
+    start = default_timer()
+    obj = build()
+    build_time = default_timer() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(
+        "{:<8} build {:8.3f}s   memory {:8.1f} MB".format(
+            name, build_time, memory / 2**20
+        )
+    )
+    for opname, op in ops:
+        start = default_timer()
+        op(obj)
+        print("{:<8} {:<16} {:8.4f}s".format(name, opname, default_timer() - start))
+
+
+def main(nusers=2000, nmovies=20000, per_user=400):
+    users = list(synthetic_users(nusers, nmovies, per_user))
+    print("ratings:", sum(len(d) for _, d in users))
+
+    def build_dicts():
+        obj = DictRatings()
+        for username, data in users:
+            obj.add_user_data(username, data)
+        return obj
+
+    def build_arrays():
+        obj = RatingMatrix()
+        for username, data in users:
+            obj.add_user_data(username, data)
+        obj._storage
+        return obj
+
+    measure(
+        "dicts",
+        build_dicts,
+        [
+            ("global_mean", lambda o: o.global_mean()),
+            ("votes", lambda o: o.votes()),
+            ("trainset", lambda o: o.trainset()),
+        ],
+    )
+    measure(
+        "arrays",
+        build_arrays,
+        [
+            ("global_mean", lambda o: o.global_mean(reset_cache=True)),
+            ("votes", lambda o: o._storage.movie_counts()),
+            ("sparsity", lambda o: o.sparsity()),
+            ("trainset", lambda o: RecSys(o).numpy_trainset()),
+            ("filter", lambda o: o.filter(minvotes=50)),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -0,0 +1,159 @@
+"""
+Timed benchmarks of the hot paths on synthetic data, written as json so
+runs of different commits can be compared.
+
+Run from the src directory:
+``python -m benchmarks.suite [--users N] [--movies N] [--density D]
+[--seed S] [--repeat R] [--output results.json]``
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+import numpy as np
+
+from recsys import RatingMatrix, RecSys, TrainedModel
+from benchmarks.synthetic import synthetic_data
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        function()
+        times.append(default_timer() - start)
+    return times
+
+
+def build(users):
+    rm = RatingMatrix()
+    for username, data in users.items():
+        rm.add_user_data(username, data)
+    rm._storage
+    return rm
+
+
+def make_model(rm, seed, nfactors):
+    np.random.seed(seed)
+    model = RecSys(rm, nfactors=nfactors, lr=0.005)
+    model.set_testset(0.1)
+    model.initialize()
+    return model
+
+
+def commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode().strip()
+
+
+def run(users=5000, movies=20000, density=0.01, seed=0, repeat=3, nfactors=50):
+    data = synthetic_data(users, movies, density, seed)
+    rm = build(data)
+    nratings = rm._storage.nnz
+    results = {}
+
+    def bench(name, function, items):
+        times = timed(function, repeat)
+        results[name] = {
+            "best": min(times),
+            "mean": sum(times) / len(times),
+            "times": times,
+            "items": items,
+            "per_item": min(times) / max(1, items),
+        }
+        print(
+            "{:<20} best {:9.4f}s  mean {:9.4f}s  {:10.3g} s/item".format(
+                name, min(times), sum(times) / len(times), results[name]["per_item"]
+            )
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ratings.json")
+        rm.to_json(path)
+        bench("read_json", lambda: RatingMatrix.read_json(path)._storage, nratings)
+    bench("add_user_data", lambda: build(data), nratings)
+    bench("filter", lambda: rm.filter(minvotes=20), nratings)
+    bench(
+        "numpy_trainset",
+        lambda: make_model(rm, seed, nfactors).numpy_trainset(),
+        nratings,
+    )
+
+    # compile the kernels outside the timings
+    model = make_model(rm, seed, nfactors)
+    model.train(epochs=1, verbose=False)
+    ntrain = model.numpy_trainset().shape[0]
+    bench("sgd_epoch", lambda: model.train(epochs=1, verbose=False), ntrain)
+
+    trained = TrainedModel(model)
+    sample = list(data.values())[:100]
+    folded = [trained.train(d) for d in sample]
+    bench("fold_in", lambda: [trained.train(d) for d in sample], len(sample))
+    bench(
+        "recommend",
+        lambda: [
+            trained.recommend(b, U, d, 1000) for d, (_, b, U) in zip(sample, folded)
+        ],
+        len(sample),
+    )
+    bench(
+        "similarity_index",
+        lambda: trained.build_similarity_index(50),
+        len(trained._movie_indices),
+    )
+    queries = list(trained._movie_indices)[:100]
+    bench(
+        "similar_movies",
+        lambda: [trained.similar_movies(q, 10) for q in queries],
+        len(queries),
+    )
+
+    return {
+        "config": {
+            "users": users,
+            "movies": movies,
+            "density": density,
+            "seed": seed,
+            "repeat": repeat,
+            "nfactors": nfactors,
+            "ratings": nratings,
+        },
+        "commit": commit(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--density", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--nfactors", type=int, default=50)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+    report = run(
+        args.users, args.movies, args.density, args.seed, args.repeat, args.nfactors
+    )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("written to", args.output)
+
+
+if __name__ == "__main__":
+    main()
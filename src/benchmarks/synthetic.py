@@ -0,0 +1,42 @@
+"""
+Deterministic synthetic rating data that looks like the Letterboxd scrape:
+power-law movie popularity, an exponential number of ratings per user and
+ratings 1..10 from a low-rank model plus noise.
+"""
+import numpy as np
+
+from recsys import RatingMatrix
+
+
+def synthetic_users(nusers, nmovies, per_user, seed=0, rank=10, exponent=1.0):
+    # power-law movie popularity; ratings 1..10 come from a low-rank model
+    # plus noise, so a factor model has something to learn
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, nmovies + 1) ** exponent
+    popularity /= popularity.sum()
+    movie_factors = rng.normal(0, 1 / np.sqrt(rank), (nmovies, rank))
+    movie_bias = rng.normal(0, 1, nmovies)
+    for u in range(nusers):
+        n = min(nmovies, max(1, int(rng.exponential(per_user))))
+        mids = rng.choice(nmovies, n, replace=False, p=popularity)
+        user = rng.normal(0, 1, rank)
+        ratings = 6 + rng.normal(0, 1) + movie_bias[mids] + movie_factors[mids] @ user
+        ratings = np.clip(np.rint(ratings + rng.normal(0, 1, n)), 1, 10)
+        yield "user{}".format(u), {
+            "movie{}".format(m): int(r) for m, r in zip(mids, ratings)
+        }
+
+
+def synthetic_data(nusers, nmovies, density, seed=0, exponent=1.0):
+    # username -> ratings, on average density * nmovies ratings per user
+    per_user = max(1.0, density * nmovies)
+    return dict(synthetic_users(nusers, nmovies, per_user, seed, exponent=exponent))
+
+
+def synthetic_matrix(nusers, nmovies, density, seed=0, exponent=1.0):
+    rm = RatingMatrix()
+    for username, data in synthetic_data(
+        nusers, nmovies, density, seed, exponent
+    ).items():
+        rm.add_user_data(username, data)
+    return rm
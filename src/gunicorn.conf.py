@@ -0,0 +1,11 @@
+# gunicorn settings, picked up by ``gunicorn myapp:app`` in the src directory.
+# Every worker loads the model and compiles the kernels before it accepts
+# requests; set MYAPP_WARMUP=0 to skip that.
+import os
+
+
+def post_worker_init(worker):
+    if os.environ.get("MYAPP_WARMUP", "1") != "0":
+        from myapp import warm_up
+
+        warm_up()
@@ -1 +1,9 @@
-from letterboxd_scrape.methods import get_ratings, find_tmdbid
+from letterboxd_scrape.methods import (
+    get_ratings,
+    get_ratings_async,
+    find_tmdbid,
+    films_link,
+    get_username_list,
+)
+from letterboxd_scrape.cache import RatingsCache
+from letterboxd_scrape.executor import get_executor, shutdown
@@ -0,0 +1,87 @@
+import os
+import pickle
+import time
+
+from letterboxd_scrape.executor import get_executor
+from letterboxd_scrape.methods import films_link, get_ratings
+from letterboxd_scrape.parse import parse_page, parse_page_count, parse_ratings
+
+
+class RatingsCache:
+    # the ratings of every user are stored as a pickled dict in
+    # <directory>/<username>.pkl, the format of the initial scrape, and the
+    # modification time of that file is the time of the last refresh. The
+    # directory is created by the first store
+    def __init__(self, directory, ttl=24 * 3600):
+        self._directory = directory
+        self._ttl = ttl
+
+    def _path(self, username):
+        return os.path.join(self._directory, "{}.pkl".format(username))
+
+    def __contains__(self, username):
+        return os.path.exists(self._path(username))
+
+    def age(self, username):
+        return time.time() - os.path.getmtime(self._path(username))
+
+    def load(self, username):
+        if username not in self:
+            return None
+        with open(self._path(username), "rb") as f:
+            return pickle.load(f)
+
+    def store(self, username, ratings):
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._path(username)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(ratings, f)
+        os.replace(path + ".tmp", path)
+
+    def delete(self, username):
+        if username in self:
+            os.remove(self._path(username))
+
+    def refresh(self, username, cached):
+        # the films list shows the most recently added films first, so the
+        # walk stops at the first page without new or changed ratings once a
+        # known rating has been seen; pages before that may hold unrated
+        # films only. Ratings changed or removed further down are only
+        # picked up by a full scrape
+        new = {}
+        known = False
+        page, npages = 1, 1
+        while page <= npages:
+            response = get_executor().get(films_link(username, page))
+            if response.status_code == 404:
+                if page == 1:
+                    self.delete(username)
+                    return 404
+                break
+            response.raise_for_status()
+            tree = parse_page(response.content)
+            if page == 1:
+                npages = parse_page_count(tree)
+            ratings = parse_ratings(tree)
+            new.update(ratings)
+            unchanged = [cached.get(f) == r for f, r in ratings.items()]
+            known = known or any(unchanged)
+            if known and all(unchanged):
+                break
+            page += 1
+        ratings = {**cached, **new}
+        self.store(username, ratings)
+        return ratings
+
+    def get_ratings(self, username, full=False):
+        # cached ratings younger than the ttl are returned as they are, older
+        # ones are refreshed incrementally; unknown users are scraped in full
+        cached = None if full else self.load(username)
+        if cached is None:
+            ratings = get_ratings(username)
+            if ratings != 404:
+                self.store(username, ratings)
+            return ratings
+        if self.age(username) < self._ttl:
+            return cached
+        return self.refresh(username, cached)
@@ -0,0 +1,116 @@
+import atexit
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# statuses after which a request is retried and every request waits
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class ScrapeExecutor:
+    # all requests of the process go through one executor: a keep-alive
+    # session, at most max_in_flight requests at the same time and a shared
+    # backoff that grows on 429 and 5xx responses and shrinks on success
+    def __init__(self, max_in_flight=16, retries=4, backoff=0.5, max_backoff=60.0):
+        self._max_in_flight = max_in_flight
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4, pool_maxsize=max_in_flight
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_in_flight, "scrape")
+        self._lock = threading.Lock()
+        self._delay = 0.0
+        self._pause_until = 0.0
+        self._closed = False
+
+    def _wait(self):
+        with self._lock:
+            pause = self._pause_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def _throttled(self, retry_after=None):
+        with self._lock:
+            self._delay = min(self._max_backoff, max(self._backoff, 2 * self._delay))
+            delay = self._delay
+            if retry_after is not None:
+                delay = min(self._max_backoff, max(delay, retry_after))
+            self._pause_until = max(self._pause_until, time.monotonic() + delay)
+
+    def _succeeded(self):
+        with self._lock:
+            self._delay /= 2
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, url):
+        # returns the response, after up to `retries` retries when the
+        # status asks for it or the connection fails
+        if self._closed:
+            raise RuntimeError("scrape executor is shut down")
+        for attempt in range(self._retries + 1):
+            self._wait()
+            try:
+                with self._in_flight:
+                    response = self._session.get(url, timeout=30)
+            except requests.ConnectionError:
+                if attempt == self._retries:
+                    raise
+                self._throttled()
+                continue
+            if response.status_code not in RETRY_STATUS:
+                self._succeeded()
+                return response
+            if attempt < self._retries:
+                self._throttled(self._retry_after(response))
+        return response
+
+    def submit(self, url):
+        return self._pool.submit(self.get, url)
+
+    def map(self, function, urls):
+        # applies function to the response of every url, the requests run
+        # in the worker threads of the executor
+        return list(self._pool.map(lambda url: function(self.get(url)), urls))
+
+    def shutdown(self):
+        self._closed = True
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._session.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # the executor of the process, started on first use and shut down at
+    # exit
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ScrapeExecutor()
+                atexit.register(shutdown)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -1,66 +1,96 @@
-import requests
-from bs4 import BeautifulSoup
-import multiprocessing
+import asyncio
 import functools
+import os
+
+from bs4 import BeautifulSoup
+
+from letterboxd_scrape.executor import get_executor
+from letterboxd_scrape.parse import parse_page, parse_page_count, parse_ratings
+
+# the site can be replaced by a local stand-in serving saved pages by
+# setting LETTERBOXD_URL, which is read on every call
+BASE_URL = "https://letterboxd.com"
+# number of pages of one user fetched at the same time, the executor limits
+# the requests of all users together
+CONCURRENCY = 8
+
+
+def base_url():
+    return os.environ.get("LETTERBOXD_URL", BASE_URL)
+
+
+def films_link(username, page):
+    return "{}/{}/films/page/{}".format(base_url(), username, page)
 
 
 def find_tmdbid(movie_link):
-    response = requests.get("https://letterboxd.com/film/{}".format(movie_link))
+    response = get_executor().get("{}/film/{}".format(base_url(), movie_link))
     soup = BeautifulSoup(response.content, "lxml")
     return int(soup.select("body")[0]["data-tmdb-id"])
 
 
 def _get_ratings_from_link(link):
-    page = requests.get(link)
+    page = get_executor().get(link)
     if page.status_code == 404:
         return 404
-    soup = BeautifulSoup(page.content, "lxml")
-    poster_containers = soup.select("li.poster-container")
-    ratings = {}
-    for pc in poster_containers:
-        film_link = pc.select("div.poster")[0]["data-target-link"].split("/")[2]
-        rating_element = pc.select("span.rating")
-        if not rating_element:
+    page.raise_for_status()
+    return parse_ratings(parse_page(page.content))
+
+
+async def _fetch(semaphore, link):
+    async with semaphore:
+        return await asyncio.wrap_future(get_executor().submit(link))
+
+
+async def get_ratings_async(username, concurrency=CONCURRENCY):
+    # reads the first page for the number of pages, then fetches all other
+    # pages at once with at most `concurrency` requests in flight
+    semaphore = asyncio.Semaphore(concurrency)
+    first = await _fetch(semaphore, films_link(username, 1))
+    if first.status_code == 404:
+        return 404
+    first.raise_for_status()
+    tree = parse_page(first.content)
+    ratings = parse_ratings(tree)
+    pages = await asyncio.gather(
+        *(
+            _fetch(semaphore, films_link(username, i))
+            for i in range(2, parse_page_count(tree) + 1)
+        )
+    )
+    for page in pages:
+        if page.status_code == 404:
             continue
-        rating = int(rating_element[0]["class"][3].split("-")[1])
-        ratings[film_link] = rating
+        page.raise_for_status()
+        ratings.update(parse_ratings(parse_page(page.content)))
     return ratings
 
 
-def _get_ratings_multiprocessing(username, processes):
-    pool = multiprocessing.Pool(processes)
-    link = lambda i: "https://letterboxd.com/{}/films/page/{}".format(username, i)
-    results = []
-    n = 1
-    while True:
-        urls = [link(i) for i in range(n, n + 2 * processes)]
-        results += pool.map(_get_ratings_from_link, urls)
-        if 404 in results:
-            return 404
-        if {} in results:
-            break
-        n += 2 * processes
-    pool.close()
-    return functools.reduce(lambda x, y: {**x, **y}, results)
-
-
-def _get_ratings(username):
-    link = lambda i: "https://letterboxd.com/{}/films/page/{}".format(username, i)
-    ratings = {}
-    i = 1
-    while True:
-        url = link(i)
-        new = _get_ratings_from_link(url)
-        if new == 404:
-            return 404
-        if not new:
-            break
-        ratings = {**ratings, **new}
-        i += 1
-    return ratings
+def get_ratings(username, concurrency=CONCURRENCY):
+    # synchronous wrapper around get_ratings_async, not for use inside a
+    # running event loop
+    return asyncio.run(get_ratings_async(username, concurrency))
+
+
+def _parse_usernames(response, max_watched):
+    usernames = set([])
+    soup = BeautifulSoup(response.content, "lxml")
+    pieces = soup.select("a.has-icon.icon-16.icon-watched")
+    for p in pieces:
+        if int(p.getText().replace(",", "")) <= max_watched:
+            uname = p["href"].split("/")[1]
+            usernames.add(uname)
+    return usernames
 
 
-def get_ratings(username, processes=0):
-    if processes > 0:
-        return _get_ratings_multiprocessing(username, processes)
-    return _get_ratings(username)
+def get_username_list(max_watched, pages=128):
+    # popular members of all time, this week, this month and this year who
+    # watched at most max_watched films
+    lists = ["popular", "popular/this/week", "popular/this/month", "popular/this/year"]
+    urls = [
+        "{}/people/{}/page/{}".format(base_url(), name, i)
+        for name in lists
+        for i in range(1, pages + 1)
+    ]
+    parse = functools.partial(_parse_usernames, max_watched=max_watched)
+    return functools.reduce(lambda x, y: x | y, get_executor().map(parse, urls))
@@ -0,0 +1,41 @@
+from lxml import etree, html
+
+# films list pages are parsed with lxml directly instead of a BeautifulSoup
+# tree, the queries below match what the css selectors li.poster-container,
+# div.poster, span.rating and li.paginate-page a used to select
+
+
+def _has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+
+_poster_containers = etree.XPath("//li[{}]".format(_has_class("poster-container")))
+_target_link = etree.XPath(".//div[{}]/@data-target-link".format(_has_class("poster")))
+_rating_class = etree.XPath(".//span[{}]/@class".format(_has_class("rating")))
+_page_numbers = etree.XPath("//li[{}]//a/text()".format(_has_class("paginate-page")))
+
+
+def parse_page(content):
+    if not content.strip():
+        return html.fromstring("<html></html>")
+    return html.fromstring(content)
+
+
+def parse_ratings(tree):
+    # film link and rating of every rated film on a films list page, the
+    # rating is the number in the rated-N class of the rating element
+    ratings = {}
+    for pc in _poster_containers(tree):
+        film_link = _target_link(pc)[0].split("/")[2]
+        rating_class = _rating_class(pc)
+        if not rating_class:
+            continue
+        ratings[film_link] = int(rating_class[0].split()[3].split("-")[1])
+    return ratings
+
+
+def parse_page_count(tree):
+    # the last entry of the pagination is the number of pages, a list that
+    # fits on one page has no pagination
+    pages = [int(text) for text in _page_numbers(tree) if text.strip().isdigit()]
+    return max(pages, default=1)
@@ -1,3 +1,6 @@
+import os
+import threading
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bootstrap import Bootstrap
@@ -8,9 +11,64 @@ from recsys import TrainedModel
 APP_NAME = "dummy name"
 ILLEGAL_GENRES = set(["Documentary"])
 SQLALCHEMY_DATABASE_URI = "sqlite:///data.db"
-MODEL = TrainedModel.read_json("model.json")
+MODEL_BIN = "model.bin"
+MODEL_JSON = "model.json"
+SCRAPE_CACHE_DIR = "scrape_cache"
+SCRAPE_CACHE_TTL = 3600
+JOB_WORKERS = 4
+RECS_PER_PAGE = 60
 # -------------------------------------------------------------------------------
 
+_state = None
+_state_lock = threading.Lock()
+
+
+def _load_state():
+    from myapp.catalog import Catalog
+
+    if os.path.exists(MODEL_BIN):
+        model = TrainedModel.read_binary(MODEL_BIN)
+    else:
+        model = TrainedModel.read_json(MODEL_JSON)
+    with app.app_context():
+        catalog = Catalog.from_db(model)
+    return model, catalog
+
+
+def get_state():
+    # the model and the movie catalog aligned with it, loaded on first use
+    # instead of at import. Use the pair from one call, so that both belong
+    # to the same model
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = _load_state()
+    return _state
+
+
+def get_model():
+    return get_state()[0]
+
+
+def reload():
+    # loads the model files and the database again and swaps model and
+    # catalog at once, requests keep the pair they already have
+    global _state
+    state = _load_state()
+    with _state_lock:
+        _state = state
+
+
+def warm_up(nmovies=50):
+    # loads the model and the catalog and runs a small recommendation, so
+    # that the first request of a worker does not pay for loading them
+    model = get_model()
+    data = {movie: 7 for movie in list(model._movie_indices)[:nmovies]}
+    N, b, U = model.train(data)
+    model.recommend(b, U, data, 10)
+
+
 app = Flask(__name__)
 
 # app configuration
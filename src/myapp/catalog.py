@@ -0,0 +1,126 @@
+from collections import namedtuple
+
+import numpy as np
+from sqlalchemy.orm import selectinload
+
+from myapp.db_models import Movie
+
+Named = namedtuple("Named", ["name"])
+
+
+class CatalogMovie:
+    # read-only view of one movie of the catalog, with the attributes and
+    # methods of db_models.Movie that the templates use
+    def __init__(self, catalog, index):
+        self._catalog = catalog
+        self._index = index
+
+    letterboxd_link = property(lambda self: self._catalog.links[self._index])
+    title = property(lambda self: self._catalog.titles[self._index])
+    original_title = property(lambda self: self._catalog.original_titles[self._index])
+    synopsis = property(lambda self: self._catalog.synopses[self._index])
+    year = property(lambda self: int(self._catalog.years[self._index]))
+    ignore_me = property(lambda self: bool(self._catalog.ignore[self._index]))
+
+    @property
+    def genres(self):
+        return [Named(name) for name in self._catalog.genre_list(self._index)]
+
+    @property
+    def directors(self):
+        return [Named(name) for name in self._catalog.directors[self._index]]
+
+    def poster_path(self):
+        return "https://image.tmdb.org/t/p/w342/{}".format(
+            self._catalog.posters[self._index]
+        )
+
+    def director_string(self):
+        return ", ".join(self._catalog.directors[self._index])
+
+
+class Catalog:
+    # movie metadata in arrays aligned with the indices of a TrainedModel.
+    # known marks the movies that are in the database, genres are bitsets
+    # over genre_names
+    def __init__(self, movie_indices):
+        n = len(movie_indices)
+        self.movie_indices = movie_indices
+        self.links = np.empty(n, dtype=object)
+        for link, i in movie_indices.items():
+            self.links[i] = link
+        self.known = np.zeros(n, dtype=bool)
+        self.titles = np.full(n, "", dtype=object)
+        self.original_titles = np.full(n, "", dtype=object)
+        self.synopses = np.full(n, "", dtype=object)
+        self.posters = np.full(n, "", dtype=object)
+        self.years = np.full(n, -1, dtype=np.int32)
+        self.ignore = np.zeros(n, dtype=bool)
+        self.directors = np.empty(n, dtype=object)
+        self.directors[:] = [()] * n
+        self.genres = np.zeros(n, dtype=np.uint64)
+        self.genre_names = []
+
+    @classmethod
+    def from_db(cls, model):
+        # reads all movies with their genres and directors in a few queries
+        catalog = cls(model._movie_indices)
+        genre_bits = {}
+        movies = Movie.query.options(
+            selectinload(Movie.genres), selectinload(Movie.directors)
+        )
+        for m in movies:
+            i = model._movie_indices.get(m.letterboxd_link)
+            if i is None:
+                continue
+            catalog.known[i] = True
+            catalog.titles[i] = m.title
+            catalog.original_titles[i] = m.original_title
+            catalog.synopses[i] = m.synopsis
+            catalog.posters[i] = m.poster
+            catalog.years[i] = m.year
+            catalog.ignore[i] = m.ignore_me
+            catalog.directors[i] = tuple(d.name for d in m.directors)
+            bits = 0
+            for g in m.genres:
+                if g.name not in genre_bits:
+                    if len(genre_bits) == 64:
+                        raise ValueError("more than 64 genres")
+                    genre_bits[g.name] = len(genre_bits)
+                    catalog.genre_names.append(g.name)
+                bits |= 1 << genre_bits[g.name]
+            catalog.genres[i] = bits
+        return catalog
+
+    def __contains__(self, link):
+        i = self.movie_indices.get(link)
+        return i is not None and self.known[i]
+
+    def matches(self, link, title="", director="", after=None):
+        # known movies whose title or original title and one of whose
+        # directors contain the search strings, released after the year
+        i = self.movie_indices.get(link)
+        if i is None or not self.known[i]:
+            return False
+        if after is not None and self.years[i] <= after:
+            return False
+        title = title.lower()
+        if title and not (
+            title in self.titles[i].lower() or title in self.original_titles[i].lower()
+        ):
+            return False
+        director = director.lower()
+        return not director or any(
+            director in name.lower() for name in self.directors[i]
+        )
+
+    def genre_list(self, index):
+        bits = int(self.genres[index])
+        return [name for k, name in enumerate(self.genre_names) if bits >> k & 1]
+
+    def movie(self, link):
+        return CatalogMovie(self, self.movie_indices[link])
+
+    def movies(self, links):
+        # the known movies of links in the same order
+        return [self.movie(link) for link in links if link in self]
@@ -1,7 +1,11 @@
 import os
 from myapp import db, ILLEGAL_GENRES
-from letterboxd_scrape import find_tmdbid
-import tmdbsimple as tmdb
+from letterboxd_scrape import find_tmdbid, get_executor
+from sqlalchemy.orm import selectinload
+
+# the api can be replaced by a local stand-in by setting TMDB_URL, which is
+# read on every call
+TMDB_URL = "https://api.themoviedb.org/3"
 
 movie_genres = db.Table(
     "movie_genres",
@@ -55,15 +59,28 @@ class Movie(db.Model):
         "Genre",
         secondary=movie_genres,
         backref=db.backref("movies", lazy="dynamic"),
-        lazy="dynamic",
+        lazy="select",
     )
     directors = db.relationship(
         "Director",
         secondary=movie_directors,
         backref=db.backref("movies", lazy="dynamic"),
-        lazy="dynamic",
+        lazy="select",
     )
 
+    @classmethod
+    def by_links(cls, links):
+        # the movies of links in the same order, with their genres and
+        # directors, in one IN query plus one query per relationship.
+        # links without a movie are left out
+        found = {
+            m.letterboxd_link: m
+            for m in cls.query.options(
+                selectinload(cls.genres), selectinload(cls.directors)
+            ).filter(cls.letterboxd_link.in_(links))
+        }
+        return [found[link] for link in links if link in found]
+
     def poster_path(self):
         return "https://image.tmdb.org/t/p/w342/{}".format(self.poster)
 
@@ -77,21 +94,22 @@ class Movie(db.Model):
 # -------------------------------------------------------------------------------
 
 
-def make_movie(letterboxd_link):
-    tmdb.API_KEY = os.environ["TMDB_API_KEY"]
+def fetch_movie(letterboxd_link):
+    # the columns of a movie, its genres and its directors. The tmdb id comes
+    # from the letterboxd film page, details and credits from one tmdb
+    # request; both go through the scrape executor
     mid = find_tmdbid(letterboxd_link)
-    movie = tmdb.Movies(mid)
-    movie.info()
-    movie.credits()
-    title = movie.title
-    original_title = movie.original_title
-    year = int(movie.release_date.split("-")[0])
-    poster = movie.poster_path
-    synopsis = movie.overview
-
-    genres = movie.genres
+    response = get_executor().get(
+        "{}/movie/{}?api_key={}&append_to_response=credits".format(
+            os.environ.get("TMDB_URL", TMDB_URL), mid, os.environ["TMDB_API_KEY"]
+        )
+    )
+    response.raise_for_status()
+    info = response.json()
+
+    genres = info["genres"]
     directors = []
-    for x in movie.crew:
+    for x in info["credits"]["crew"]:
         if x["job"] == "Director":
             directors.append({"id": x["id"], "name": x["name"]})
 
@@ -100,14 +118,19 @@ def make_movie(letterboxd_link):
         if g["name"] in ILLEGAL_GENRES:
             ignore = True
 
-    movie_entry = Movie(
+    movie = dict(
         letterboxd_link=letterboxd_link,
         tmdb=mid,
-        title=title,
-        original_title=original_title,
-        year=year,
-        poster=poster,
-        synopsis=synopsis,
+        title=info["title"],
+        original_title=info["original_title"],
+        year=int(info["release_date"].split("-")[0]),
+        poster=info["poster_path"],
+        synopsis=info["overview"],
         ignore_me=ignore,
     )
-    return movie_entry, genres, directors
+    return movie, genres, directors
+
+
+def make_movie(letterboxd_link):
+    movie, genres, directors = fetch_movie(letterboxd_link)
+    return Movie(**movie), genres, directors
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from myapp import db
+from myapp.metrics import stage
+from myapp.db_models import (
+    Movie,
+    Genre,
+    Director,
+    movie_genres,
+    movie_directors,
+    fetch_movie,
+)
+
+
+def _fetch(link):
+    try:
+        with stage("import.fetch"):
+            return link, fetch_movie(link), None
+    except Exception as e:
+        return link, None, e
+
+
+class MovieImporter:
+    # adds the movies of links that are not in the database yet. Up to
+    # `workers` movies are fetched at the same time; every `batch` movies
+    # are written with bulk inserts in one transaction, so an interrupted
+    # import resumes after the last written batch. Genres and directors
+    # are looked up in memory
+    def __init__(self, workers=8, batch=200):
+        self._workers = workers
+        self._batch = batch
+        self._genres = set(g for (g,) in db.session.query(Genre.tmdb))
+        self._directors = set(d for (d,) in db.session.query(Director.tmdb))
+        self._tmdb_ids = set(t for (t,) in db.session.query(Movie.tmdb))
+        self.added = []
+        self.errors = []
+
+    def missing(self, links):
+        known = set(link for (link,) in db.session.query(Movie.letterboxd_link))
+        return [link for link in links if link not in known]
+
+    def _write(self, results):
+        movies, genres, directors, links_genres, links_directors = [], [], [], [], []
+        for link, fetched, error in results:
+            if error is None and fetched[0]["tmdb"] in self._tmdb_ids:
+                error = ValueError("tmdb id {} is in use".format(fetched[0]["tmdb"]))
+            if error is not None:
+                self.errors.append((link, error))
+                continue
+            movie, movie_genre_list, movie_director_list = fetched
+            self._tmdb_ids.add(movie["tmdb"])
+            movies.append(movie)
+            self.added.append(link)
+            if movie["ignore_me"]:
+                continue
+            for g in movie_genre_list:
+                if g["id"] not in self._genres:
+                    self._genres.add(g["id"])
+                    genres.append({"tmdb": g["id"], "name": g["name"]})
+                links_genres.append({"movie_link": link, "genre_id": g["id"]})
+            for d in movie_director_list:
+                if d["id"] not in self._directors:
+                    self._directors.add(d["id"])
+                    directors.append({"tmdb": d["id"], "name": d["name"]})
+                links_directors.append({"movie_link": link, "director_id": d["id"]})
+        for table, rows in (
+            (Movie.__table__, movies),
+            (Genre.__table__, genres),
+            (Director.__table__, directors),
+            (movie_genres, links_genres),
+            (movie_directors, links_directors),
+        ):
+            if rows:
+                db.session.execute(table.insert(), rows)
+        db.session.commit()
+        return len(movies)
+
+    def run(self, links):
+        # yields a progress line after every written batch
+        # and fetches the next batch while writing the current one
+        links = self.missing(links)
+        starts = range(0, len(links), self._batch)
+        with ThreadPoolExecutor(self._workers) as pool:
+            pending = pool.map(_fetch, links[: self._batch])
+            for start in starts:
+                results = list(pending)
+                following = links[start + self._batch : start + 2 * self._batch]
+                pending = pool.map(_fetch, following)
+                with stage("import.write"):
+                    added = self._write(results)
+                yield "{} / {}: added {}, {} errors so far<br>".format(
+                    min(start + self._batch, len(links)),
+                    len(links),
+                    added,
+                    len(self.errors),
+                )
+
+    def write_reports(self, log_path, ignore_path):
+        # the log lists the errors of this run. The ignore file is rebuilt
+        # from the ignored movies of the database and the movies that failed
+        # in this run, failed movies are retried by the next run
+        with open(log_path, "w") as log_file:
+            for movie_link, e in self.errors:
+                log_file.write("error with {} : {} \n\n".format(movie_link, e))
+        with open(ignore_path, "w") as ignore_file:
+            for (movie_link,) in db.session.query(Movie.letterboxd_link).filter_by(
+                ignore_me=True
+            ):
+                ignore_file.write("{}\n".format(movie_link))
+            for movie_link, _ in self.errors:
+                ignore_file.write("{}\n".format(movie_link))
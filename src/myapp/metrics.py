@@ -0,0 +1,91 @@
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# set MYAPP_METRICS=0 to turn the timers into no-ops
+ENABLED = os.environ.get("MYAPP_METRICS", "1") != "0"
+
+# upper bounds of the histogram buckets in seconds, 10us to about 170s
+BUCKETS = [1e-5 * 2**k for k in range(25)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        # upper bound of the bucket that holds the q-quantile, at most the
+        # largest value seen
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self):
+        # plain text, one line per stage and statistic
+        lines = []
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                labels = 'stage="{}"'.format(name)
+                for q in (0.5, 0.95, 0.99):
+                    lines.append(
+                        'stage_seconds{{{},quantile="{}"}} {:.6f}'.format(
+                            labels, q, h.quantile(q)
+                        )
+                    )
+                lines.append("stage_seconds_count{{{}}} {}".format(labels, h.count))
+                lines.append("stage_seconds_sum{{{}}} {:.6f}".format(labels, h.sum))
+                lines.append("stage_seconds_max{{{}}} {:.6f}".format(labels, h.max))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+@contextlib.contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - start)
+
+
+def stage(name):
+    # with stage("recommendations.scrape"): ... records the duration of the
+    # block, also when it raises
+    if not ENABLED:
+        return contextlib.nullcontext()
+    return _timer(name)
+
+
+def observe(name, seconds):
+    if ENABLED:
+        REGISTRY.observe(name, seconds)
@@ -1,12 +1,58 @@
-from flask import render_template, flash, redirect, url_for, request, Response
+from flask import (
+    render_template,
+    flash,
+    redirect,
+    url_for,
+    request,
+    Response,
+    jsonify,
+    stream_with_context,
+    g,
+)
 
-from myapp import app, db, APP_NAME, MODEL
+from myapp import (
+    app,
+    db,
+    APP_NAME,
+    SCRAPE_CACHE_DIR,
+    SCRAPE_CACHE_TTL,
+    JOB_WORKERS,
+    RECS_PER_PAGE,
+    MODEL_BIN,
+    get_model,
+    get_state,
+    reload,
+)
 from myapp.forms import UsernameForm
-from myapp.db_models import Movie, Genre, Director, make_movie
+from myapp.tasks import JobQueue
+from myapp.db_models import Movie
+from myapp.importer import MovieImporter
+from myapp.metrics import ENABLED as METRICS_ENABLED, REGISTRY, observe, stage
 
-from letterboxd_scrape import get_ratings
+from letterboxd_scrape import RatingsCache
+from recsys.user_store import UserVectorStore
 
 import os
+import time
+
+import requests
+
+RATINGS = RatingsCache(SCRAPE_CACHE_DIR, SCRAPE_CACHE_TTL)
+JOBS = JobQueue(JOB_WORKERS)
+USER_VECTORS = UserVectorStore()
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def stop_timer(response):
+    # streamed responses are timed until streaming starts
+    if "start" in g and request.endpoint is not None:
+        observe("request." + request.endpoint, time.perf_counter() - g.start)
+    return response
 
 
 @app.context_processor
@@ -25,94 +71,140 @@ def index():
     return render_template("index.html", form=form)
 
 
+def make_recommendations(username):
+    # runs on the job queue, returns 404 for unknown users
+    with stage("recommendations.scrape"):
+        data = RATINGS.get_ratings(username)
+    if data == 404:
+        return 404
+    model = get_model()
+    with stage("recommendations.fold_in"):
+        N, b, U = USER_VECTORS.fold_in(model, username, data)
+    with stage("recommendations.recommend"):
+        return model.recommend(b, U, data, 1000)
+
+
 @app.route("/recommendations/<username>")
 def recommendations(username):
-    loaded = request.args.get("loaded", False)
-    if not loaded:
-        target = url_for("recommendations", username=username) + "?loaded=True"
+    job = JOBS.get(request.args.get("job", ""))
+    if job is None or job.key != username:
+        job = JOBS.submit(username, make_recommendations, username)
+    if not job.done:
+        target = url_for("recommendations", username=username, job=job.id)
         message = "Getting ratings of <b>{}</b> and making recommendations...<br>This can take long depending on how many films you have rated".format(
             username
         )
-        return render_template("loading.html", target=target, message=message)
-    data = get_ratings(username)
-    if data == 404:
+        return render_template(
+            "loading.html",
+            target=target,
+            status=url_for("job_status", job_id=job.id),
+            message=message,
+        )
+    if isinstance(job.error, requests.RequestException):
+        flash("Letterboxd is not reachable right now, please try again later")
+        return redirect(url_for("index"))
+    if job.error is not None:
+        raise job.error
+    if job.result == 404:
         flash("Not a valid Letterboxd username")
         return redirect(url_for("index"))
-    N, b, U = MODEL.train(data)
-    recs = MODEL.recommend(b, U, data)[:1000]
-    result = []
-    for movie, prediction in recs:
-        result.append(
-            (Movie.query.filter_by(letterboxd_link=movie).first(), f"{prediction:.2f}")
+    # the filters apply to all recommendations, before they are paginated
+    filters = {
+        "title": request.args.get("title", "").strip(),
+        "director": request.args.get("director", "").strip(),
+        "after": request.args.get("after", type=int),
+    }
+    filters = {name: value for name, value in filters.items() if value}
+    model, catalog = get_state()
+    with stage("recommendations.catalog"):
+        recs = [
+            (movie, prediction)
+            for movie, prediction in job.result
+            if catalog.matches(movie, **filters)
+        ]
+    pages = max(1, -(-len(recs) // RECS_PER_PAGE))
+    page = min(max(request.args.get("page", 1, type=int), 1), pages)
+    recs = recs[(page - 1) * RECS_PER_PAGE : page * RECS_PER_PAGE]
+    result = [(catalog.movie(movie), f"{prediction:.2f}") for movie, prediction in recs]
+    with stage("recommendations.render"):
+        return render_template(
+            "recs.html",
+            username=username,
+            movies=result,
+            job_id=job.id,
+            page=page,
+            pages=pages,
+            filters=filters,
         )
-    print("---------------", MODEL.cv(data, 5))
-    return render_template("recs.html", username=username, movies=result)
+
+
+def cross_validate(username):
+    # runs on the job queue
+    data = RATINGS.get_ratings(username)
+    if data == 404:
+        return 404
+    rmse, mae = get_model().cv(data, 5)
+    return {"rmse": float(rmse), "mae": float(mae)}
+
+
+@app.route("/_cv/<username>")
+def cross_validation(username):
+    # cross validation of the fold-in of a user on demand, poll with the
+    # returned job id until the status is done
+    key = "cv:" + username
+    job = JOBS.get(request.args.get("job", ""))
+    if job is None or job.key != key:
+        job = JOBS.submit(key, cross_validate, username)
+    if not job.done:
+        return jsonify(id=job.id, status=job.status), 202
+    if job.error is not None:
+        return jsonify(id=job.id, status=job.status, error=str(job.error)), 500
+    if job.result == 404:
+        return jsonify(id=job.id, status=job.status, error="unknown user"), 404
+    return jsonify(id=job.id, status=job.status, **job.result)
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify(id=job_id, status="unknown"), 404
+    return jsonify(id=job.id, status=job.status)
 
 
 @app.route("/film/<film_link>")
 def film_page(film_link):
-    m = Movie.query.filter_by(letterboxd_link=film_link).first()
+    # movies of the model come from the catalog, others from the database
+    model, catalog = get_state()
+    if film_link in catalog:
+        links = [link for link, _ in model.similar_movies(film_link, 12)]
+        return render_template(
+            "film.html", movie=catalog.movie(film_link), similar=catalog.movies(links)
+        )
+    m = next(iter(Movie.by_links([film_link])), None)
     if not m:
         flash("Movie not found in database.")
         return redirect(url_for("index"))
-    return render_template("film.html", movie=m)
+    return render_template("film.html", movie=m, similar=[])
 
 
 def moviedb_update_gen():
+    # resumable: movies already in the database are skipped, errors are
+    # retried on the next run
     db.create_all()
-    log_file = open("db_update_log.txt", "w")
-    ignore_file = open("db_ignore.txt", "w")
-    counter = 0
-    for movie_link in MODEL._movie_indices:
-        counter += 1
-        m = Movie.query.filter_by(letterboxd_link=movie_link).first()
-        if m:
-            yield "{}: movie {} already in db, skipping...<br>".format(
-                str(counter).ljust(5), movie_link
-            )
-            continue
-        try:
-            m, genres, directors = make_movie(movie_link)
-            db.session.add(m)
-            if m.ignore_me:
-                ignore_file.write("{}\n".format(movie_link))
-                yield "{}: ignored {}<br>".format(str(counter).ljust(5), movie_link)
-                continue
-            for g in genres:
-                ge = Genre.query.filter_by(tmdb=g["id"]).first()
-                if not ge:
-                    ge = Genre(tmdb=g["id"], name=g["name"])
-                    db.session.add(ge)
-                    yield ".......{}: added genre {}<br>".format(
-                        str(counter).ljust(5), ge.name
-                    )
-                m.genres.append(ge)
-                db.session.commit()
-            for d in directors:
-                di = Director.query.filter_by(tmdb=d["id"]).first()
-                if not di:
-                    di = Director(tmdb=d["id"], name=d["name"])
-                    db.session.add(di)
-                    yield ".......{}: added director {}<br>".format(
-                        str(counter).ljust(5), di.name
-                    )
-                m.directors.append(di)
-            yield "{}: added {}<br>".format(str(counter).ljust(5), movie_link)
-        except Exception as e:
-            yield "{}: Error when tryin to add {}, see logfile...<br>".format(
-                str(counter).ljust(5), movie_link
-            )
-            log_file.write("error with {} : {} \n\n".format(movie_link, e))
-            ignore_file.write("{}\n".format(movie_link))
-    log_file.close()
-    ignore_file.close()
-    db.session.commit()
-    yield "done"
+    importer = MovieImporter()
+    yield from importer.run(list(get_model()._movie_indices))
+    importer.write_reports("db_update_log.txt", "db_ignore.txt")
+    with stage("import.reload"):
+        reload()
+    yield "done, added {} movies, {} errors, see logfile".format(
+        len(importer.added), len(importer.errors)
+    )
 
 
 @app.route("/_db_update")
 def moviedb_update():
-    return Response(moviedb_update_gen())
+    return Response(stream_with_context(moviedb_update_gen()))
 
 
 def retrain_gen():
@@ -122,29 +214,48 @@ def retrain_gen():
         yield "No data folder found"
         return
     from recsys import RatingMatrix, RecSys, TrainedModel
+    from recsys.snapshot import convert, update
 
+    snapshot = data_folder + ".rms"
+    if not os.path.exists(snapshot):
+        yield "converting data folder to snapshot<br>"
+        with stage("retrain.snapshot"):
+            convert(data_folder, snapshot)
+    elif os.path.getmtime(snapshot) < os.path.getmtime(data_folder):
+        yield "updating snapshot with new scrapes<br>"
+        with stage("retrain.snapshot"):
+            update(data_folder, snapshot)
     yield "reading data<br>"
-    rm = RatingMatrix.read_pickle_folder(data_folder)
+    with stage("retrain.read"):
+        rm = RatingMatrix.read_snapshot(snapshot)
     yield "data read<br>"
-    rm.filter(minvotes=500, inplace=True)
-    yield "filtered minvotes 500<br>"
-    cor = rm._remove_multiple_mids()
-    cor.__next__()
     with open(ignore_file, "r") as f:
-        for movie in f.readlines():
-            moviename = movie[:-1]
-            if moviename in rm._mid:
-                cor.send(rm._mid[moviename])
-    cor.close()
-    yield "filtered ignore movies<br>"
+        ignore = [movie[:-1] for movie in f.readlines()]
+    with stage("retrain.filter"):
+        rm.filter(minvotes=500, exclude=ignore, inplace=True)
+    yield "filtered minvotes 500 and ignore movies<br>"
     model = RecSys(rm)
-    model.train(verbose=False)
+    with stage("retrain.train"):
+        model.train(verbose=False)
     yield "model trained<br>"
     trained = TrainedModel(model)
-    trained.pickle("model.pkl")
-    yield "done, new model will be active after reboot"
+    with stage("retrain.similarity"):
+        trained.build_similarity_index()
+    yield "similarity index built<br>"
+    with stage("retrain.write"):
+        trained.to_binary(MODEL_BIN)
+    with stage("retrain.reload"):
+        reload()
+    yield "done, new model is active (other workers pick it up after reboot)"
 
 
 @app.route("/_retrain")
 def retrain():
     return Response(retrain_gen())
+
+
+@app.route("/metrics")
+def metrics():
+    if not METRICS_ENABLED:
+        return "metrics are disabled", 404
+    return Response(REGISTRY.render(), mimetype="text/plain")
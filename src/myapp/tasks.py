@@ -1 +1,79 @@
-pass
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from myapp.metrics import observe
+
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.finished = None
+        self.submitted = time.monotonic()
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+
+class JobQueue:
+    # runs jobs on a thread pool of the web process. A job submitted while
+    # another one with the same key is queued or running is not started,
+    # the running job is returned instead. Finished jobs are kept for
+    # `keep` seconds so their result can be picked up. Jobs live in the
+    # memory of one process, so polling has to reach the same process
+    def __init__(self, workers=4, keep=600):
+        self._pool = ThreadPoolExecutor(workers, "jobs")
+        self._keep = keep
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+
+    def submit(self, key, function, *args):
+        with self._lock:
+            self._expire()
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._active[key] = job
+        self._pool.submit(self._run, job, function, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, function, args):
+        # time spent waiting for a free worker, per job function
+        observe(
+            "jobs.{}.queued".format(function.__name__), time.monotonic() - job.submitted
+        )
+        job.status = "running"
+        try:
+            job.result = function(*args)
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
+        with self._lock:
+            job.finished = time.monotonic()
+            del self._active[job.key]
+
+    def _expire(self):
+        now = time.monotonic()
+        for job_id in [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished is not None and now - job.finished > self._keep
+        ]:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,4 +1,22 @@
-from recsys.rating_matrix import RatingMatrix
-from recsys.rec import RecSys
-from recsys.foreigner import Foreigner
-from recsys.trained import TrainedModel
+# submodules are imported on first attribute access, so that for instance
+# RatingMatrix can be used without importing numba or the scraper
+_exports = {
+    "RatingMatrix": "recsys.rating_matrix",
+    "RecSys": "recsys.rec",
+    "Foreigner": "recsys.foreigner",
+    "TrainedModel": "recsys.trained",
+}
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module 'recsys' has no attribute '{}'".format(name))
+    import importlib
+
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
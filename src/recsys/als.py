@@ -0,0 +1,91 @@
+import numpy as np
+
+
+def _ridge_solve(indptr, indices, target, Y, reg, batch=256):
+    # for every row i with entries solve
+    #   min sum_j (target_ij - b_i - x_i.Y_j)^2 + reg * n_i * (b_i^2 + |x_i|^2)
+    # over (b_i, x_i), with j running over indices[indptr[i]:indptr[i + 1]].
+    # The Gram matrices come from BLAS, the solves are batched through
+    # np.linalg.solve. Returns the solved rows and their (b_i, x_i)
+    nf = Y.shape[1]
+    counts = np.diff(indptr)
+    rows = np.flatnonzero(counts)
+    result = np.empty((len(rows), nf + 1))
+    diag = np.arange(nf + 1)
+    for b in range(0, len(rows), batch):
+        chunk = rows[b : b + batch]
+        A = np.empty((len(chunk), nf + 1, nf + 1))
+        rhs = np.empty((len(chunk), nf + 1))
+        for k, row in enumerate(chunk):
+            start, stop = indptr[row], indptr[row + 1]
+            Yr = Y[indices[start:stop]]
+            t = target[start:stop]
+            A[k, 0, 0] = stop - start
+            A[k, 0, 1:] = A[k, 1:, 0] = Yr.sum(axis=0)
+            A[k, 1:, 1:] = Yr.T @ Yr
+            A[k, diag, diag] += reg * (stop - start)
+            rhs[k, 0] = t.sum()
+            rhs[k, 1:] = t @ Yr
+        result[b : b + batch] = np.linalg.solve(A, rhs[:, :, None])[:, :, 0]
+    return rows, result
+
+
+def _normal_equations(Y, target):
+    # unregularized Gram matrix and right hand side of _ridge_solve for one
+    # row with factors Y and targets target. Sums of these over disjoint
+    # sets of entries add up
+    X = np.empty((len(Y), Y.shape[1] + 1))
+    X[:, 0] = 1
+    X[:, 1:] = Y
+    return X.T @ X, target @ X
+
+
+def _als_half_sweep(indptr, indices, values, bias, X, other_bias, Y, global_mean, reg):
+    # refit every row of X and its bias with the other side fixed. This is
+    # the objective the SGD kernel minimizes, restricted to one side
+    target = values - global_mean - other_bias[indices]
+    rows, result = _ridge_solve(indptr, indices, target, Y, reg)
+    bias[rows] = result[:, 0]
+    X[rows] = result[:, 1:]
+
+
+def _fold_in(indptr, indices, values, movie_bias, M, global_mean, reg):
+    # exact bias and factors of new users with the movie side fixed. users
+    # without known movies get zeros
+    nusers = len(indptr) - 1
+    biases = np.zeros(nusers)
+    U = np.zeros((nusers, M.shape[1]))
+    target = values - global_mean - movie_bias[indices]
+    rows, result = _ridge_solve(indptr, indices, target, M, reg)
+    biases[rows] = result[:, 0]
+    U[rows] = result[:, 1:]
+    return biases, U
+
+
+def _als_train(sweeps, storage, user_bias, movie_bias, U, M, global_mean, reg, verbose):
+    for sweep in range(sweeps):
+        if verbose:
+            print("sweep", sweep)
+        _als_half_sweep(
+            storage.indptr,
+            storage.indices,
+            storage.values,
+            user_bias,
+            U,
+            movie_bias,
+            M,
+            global_mean,
+            reg,
+        )
+        _als_half_sweep(
+            storage.mindptr,
+            storage.mindices,
+            storage.mvalues,
+            movie_bias,
+            M,
+            user_bias,
+            U,
+            global_mean,
+            reg,
+        )
+    return U, M, user_bias, movie_bias
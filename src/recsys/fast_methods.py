@@ -1,45 +1,61 @@
-from numba import njit, jit
+from numba import njit, jit, prange
 import numpy as np
 import math
 
 
-def _fast_cv(dataset, movie_biases, M, global_mean, folds, lr, reg):
-    N = dataset.shape[0]
+@njit(parallel=True, cache=True)
+def _fast_cv(
+    mids,
+    ratings,
+    order,
+    bounds,
+    user_biases,
+    U,
+    movie_biases,
+    M,
+    global_mean,
+    lr,
+    reg,
+    epochs,
+):
+    # k-fold cross validation of the SGD fold-in. Fold f tests the ratings
+    # order[bounds[f]:bounds[f + 1]] and trains on all other positions of
+    # order, starting from user_biases[f] and U[f]; the folds run in
+    # parallel. Returns the squared error, absolute error and number of
+    # tested ratings of every fold
+    folds = bounds.shape[0] - 1
     nf = M.shape[1]
-    fold_size = N // folds
-    mse = 0
-    mae = 0
-    tested = 0
-    for i in range(folds):
-        test_fold = dataset[i * fold_size : (i + 1) * fold_size]
-        train = np.vstack((dataset[: i * fold_size], dataset[(i + 1) * fold_size :]))
-        ub, U = _fast_foreign_train(
-            200,
-            train,
-            np.random.normal(0, 0.1),
-            movie_biases,
-            np.random.normal(0, 0.1, nf),
-            M,
-            global_mean,
-            lr,
-            reg,
-            False,
-            False,
-        )
-        K = test_fold.shape[0]
-        for x in range(K):
-            mid, rating = int(test_fold[x, 0]), test_fold[x, 1]
-            mb = movie_biases[mid]
-            mrow = M[mid]
-            predicted = _fast_predict(ub, mb, U, mrow, global_mean, nf)
-            err = rating - predicted
-            mae += abs(err)
-            mse += err**2
-            tested += K
-    return math.sqrt(mse / tested), mae / tested
-
-
-@njit
+    N = order.shape[0]
+    errors = np.zeros((folds, 3))
+    for f in prange(folds):
+        lo, hi = bounds[f], bounds[f + 1]
+        ub = user_biases[f]
+        u = U[f]
+        for epoch in range(epochs):
+            for j in range(N):
+                if j >= lo and j < hi:
+                    continue
+                i = order[j]
+                mid = mids[i]
+                err = ratings[i] - _fast_predict(
+                    ub, movie_biases[mid], u, M[mid], global_mean, nf
+                )
+                ub += lr * (err - reg * ub)
+                for k in range(nf):
+                    u[k] += lr * (err * M[mid, k] - reg * u[k])
+        for j in range(lo, hi):
+            i = order[j]
+            mid = mids[i]
+            err = ratings[i] - _fast_predict(
+                ub, movie_biases[mid], u, M[mid], global_mean, nf
+            )
+            errors[f, 0] += err**2
+            errors[f, 1] += abs(err)
+            errors[f, 2] += 1
+    return errors
+
+
+@njit(cache=True)
 def _fast_predict(user_bias, movie_bias, Urow, Mrow, global_mean, nf):
     baseline = global_mean + user_bias + movie_bias
     dot = 0
@@ -48,7 +64,7 @@ def _fast_predict(user_bias, movie_bias, Urow, Mrow, global_mean, nf):
     return baseline + dot
 
 
-@njit
+@njit(cache=True)
 def _fast_validation_metrics(ratings, U, M, user_biases, movie_biases, global_mean, nf):
     N = ratings.shape[0]
     rmse = 0
@@ -69,7 +85,7 @@ def _fast_validation_metrics(ratings, U, M, user_biases, movie_biases, global_me
     return math.sqrt(mse), mae, mse
 
 
-@njit
+@njit(cache=True)
 def _fast_train(
     epochs,
     trainset,
@@ -81,39 +97,89 @@ def _fast_train(
     lr,
     reg,
     shuffle,
-    verbose,
+    losses,
 ):
-    np.random.shuffle(trainset)
+    # losses[epoch] gets the mean squared error of the predictions made
+    # during that epoch, before each update
     nf = M.shape[1]
     N = trainset.shape[0]
     for epoch in range(epochs):
-        if verbose:
-            print("epoch", epoch)
         if shuffle:
             np.random.shuffle(trainset)
+        loss = 0.0
         for i in range(N):
-            uid, mid, rating = int(trainset[i, 0]), int(trainset[i, 1]), trainset[i, 2]
-            pred = _fast_predict(
-                user_bias[uid], movie_bias[mid], U[uid], M[mid], global_mean, nf
+            err = _fast_sgd_step(
+                trainset, i, user_bias, movie_bias, U, M, global_mean, lr, reg, nf
             )
-            err = rating - pred
+            loss += err * err
+        losses[epoch] = loss / N
 
-            # Update biases
-            user_bias[uid] += lr * (err - reg * user_bias[uid])
-            movie_bias[mid] += lr * (err - reg * movie_bias[mid])
+    return U, M, user_bias, movie_bias
 
-            # Update latent factors
-            for f in range(nf):
-                puf = U[uid, f]
-                qmf = M[mid, f]
 
-                U[uid, f] += lr * (err * qmf - reg * puf)
-                M[mid, f] += lr * (err * puf - reg * qmf)
+@njit(parallel=True, nogil=True, cache=True)
+def _fast_train_parallel(
+    epochs,
+    trainset,
+    user_bias,
+    movie_bias,
+    U,
+    M,
+    global_mean,
+    lr,
+    reg,
+    shuffle,
+    losses,
+    threads,
+):
+    # Hogwild: every thread runs plain SGD over its own slice of the trainset
+    # and writes to the shared U, M and biases without locking. With sparse
+    # ratings two threads rarely touch the same row at the same time, and the
+    # occasional lost update does not hurt convergence
+    nf = M.shape[1]
+    N = trainset.shape[0]
+    chunk = (N + threads - 1) // threads
+    partial = np.zeros(threads)
+    for epoch in range(epochs):
+        if shuffle:
+            np.random.shuffle(trainset)
+        for t in prange(threads):
+            loss = 0.0
+            for i in range(t * chunk, min(N, (t + 1) * chunk)):
+                err = _fast_sgd_step(
+                    trainset, i, user_bias, movie_bias, U, M, global_mean, lr, reg, nf
+                )
+                loss += err * err
+            partial[t] = loss
+        losses[epoch] = partial.sum() / N
 
     return U, M, user_bias, movie_bias
 
 
-@njit
+@njit(inline="always", cache=True)
+def _fast_sgd_step(trainset, i, user_bias, movie_bias, U, M, global_mean, lr, reg, nf):
+    uid, mid, rating = int(trainset[i, 0]), int(trainset[i, 1]), trainset[i, 2]
+    pred = _fast_predict(
+        user_bias[uid], movie_bias[mid], U[uid], M[mid], global_mean, nf
+    )
+    err = rating - pred
+
+    # Update biases
+    user_bias[uid] += lr * (err - reg * user_bias[uid])
+    movie_bias[mid] += lr * (err - reg * movie_bias[mid])
+
+    # Update latent factors
+    for f in range(nf):
+        puf = U[uid, f]
+        qmf = M[mid, f]
+
+        U[uid, f] += lr * (err * qmf - reg * puf)
+        M[mid, f] += lr * (err * puf - reg * qmf)
+
+    return err
+
+
+@njit(cache=True)
 def _fast_foreign_validation(ratings, U, M, user_bias, movie_biases, global_mean, nf):
     N = ratings.shape[0]
     rmse = 0
@@ -132,7 +198,7 @@ def _fast_foreign_validation(ratings, U, M, user_bias, movie_biases, global_mean
     return math.sqrt(mse), mae, mse
 
 
-@njit
+@njit(cache=True)
 def _fast_foreign_train(
     epochs,
     trainset,
@@ -171,3 +237,49 @@ def _fast_foreign_train(
                 U[f] += lr * (err * qmf - reg * puf)
 
     return user_bias, U
+
+
+@njit(cache=True)
+def _fast_update_movie_segments(
+    mstart, mcount, mcap, mindices, mvalues, mend, uid, removed, mids, ratings
+):
+    # movie-major side of RatingStorage.set_user: drop uid from the segments
+    # of removed, then insert or update (uid, rating) in the segments of mids.
+    # the buffers must have room for every segment that has to move
+    for k in range(removed.shape[0]):
+        mid = removed[k]
+        start, n = mstart[mid], mcount[mid]
+        pos = start + np.searchsorted(mindices[start : start + n], uid)
+        for i in range(pos, start + n - 1):
+            mindices[i] = mindices[i + 1]
+            mvalues[i] = mvalues[i + 1]
+        mcount[mid] = n - 1
+
+    for k in range(mids.shape[0]):
+        mid = mids[k]
+        start, n = mstart[mid], mcount[mid]
+        pos = np.searchsorted(mindices[start : start + n], uid)
+        if pos < n and mindices[start + pos] == uid:
+            mvalues[start + pos] = ratings[k]
+            continue
+        if n == mcap[mid]:
+            cap = max(4, 2 * n)
+            new = mend
+            mend += cap
+            for i in range(pos):
+                mindices[new + i] = mindices[start + i]
+                mvalues[new + i] = mvalues[start + i]
+            for i in range(pos, n):
+                mindices[new + i + 1] = mindices[start + i]
+                mvalues[new + i + 1] = mvalues[start + i]
+            mstart[mid] = new
+            mcap[mid] = cap
+            start = new
+        else:
+            for i in range(n, pos, -1):
+                mindices[start + i] = mindices[start + i - 1]
+                mvalues[start + i] = mvalues[start + i - 1]
+        mindices[start + pos] = uid
+        mvalues[start + pos] = ratings[k]
+        mcount[mid] = n + 1
+    return mend
@@ -25,7 +25,8 @@ class Foreigner:
         name = rc._rm._uid.inverse[uid]
         f = Foreigner(rc, name, do_scrape=False)
         f._data = {}
-        for mid, r in rc._rm._data.get(uid, {}).items():
+        mids, ratings = rc._rm._storage.user(uid)
+        for mid, r in zip(mids.tolist(), ratings.tolist()):
             f._data[rc._rm._mid.inverse[mid]] = r
         return f
 
@@ -12,23 +12,18 @@ class Movie:
         return self._rm._mid.inverse[self._id]
 
     def ratedby(self):
-        return self._rm._ratedby.get(self._id, [])
+        return self._rm._storage.movie(self._id)[0]
 
     def votes(self):
         return len(self.ratedby())
 
     def ratings(self):
-        result = {}
-        for uid in self.ratedby():
-            result[uid] = self._rm._data[uid][self._id]
-        return result
+        uids, ratings = self._rm._storage.movie(self._id)
+        return dict(zip(uids.tolist(), ratings.tolist()))
 
     def mean(self):
-        m, i = 0, 0
-        for uid, r in self.ratings().items():
-            m += r
-            i += 1
-        return m / i
+        _, ratings = self._rm._storage.movie(self._id)
+        return float(ratings.sum(dtype=float)) / len(ratings)
 
     def global_rating(self):
         w = len(self.ratedby()) / self._rm._nusers
@@ -1,41 +1,113 @@
 import json
 import os
 import pickle
-from copy import deepcopy
 
+import numpy as np
 from bidict import bidict
 
 from recsys.user import User
 from recsys.movie import Movie
-import letterboxd_scrape as scrape
+from recsys.storage import RatingStorage
+from recsys.snapshot import read_snapshot, write_snapshot
 
 
 class RatingMatrix:
     def __init__(self):
-        self._data = {}
-        self._ratedby = {}
+        self._store = RatingStorage()
+        self._pending = []
         self._nusers = 0
         self._nmovies = 0
         self._uid = bidict()
         self._mid = bidict()
         self._cached_gm = None
 
+    @property
+    def _storage(self):
+        # ratings added since the last access are merged into the arrays
+        # in one go, so building a matrix user by user stays cheap
+        if self._pending:
+            uids, mids, ratings = zip(*self._pending)
+            self._pending = []
+            ouids, omids, oratings = self._store.coo()
+            self._store = RatingStorage.from_coo(
+                np.concatenate((ouids,) + uids),
+                np.concatenate((omids,) + mids),
+                np.concatenate((oratings,) + ratings),
+                self._nusers,
+                self._nmovies,
+            )
+        elif (self._store.nusers, self._store.nmovies) != (
+            self._nusers,
+            self._nmovies,
+        ):
+            self._store.resize(self._nusers, self._nmovies)
+        return self._store
+
     def add_user_data(self, username, data):
         if username not in self._uid:
             self._uid[username] = self._nusers
             self._nusers += 1
         uid = self._uid[username]
-        for movie, rating in data.items():
+        mids = self._movie_ids(list(data))
+        if len(data):
+            uids = np.full(len(data), uid, dtype=np.int32)
+            self._pending.append((uids, mids, np.array(list(data.values()))))
+            self._cached_gm = None
+
+    def _movie_ids(self, movies):
+        mids = np.empty(len(movies), dtype=np.int32)
+        for i, movie in enumerate(movies):
             if movie not in self._mid:
                 self._mid[movie] = self._nmovies
                 self._nmovies += 1
-            mid = self._mid[movie]
-            if not mid in self._ratedby:
-                self._ratedby[mid] = []
-            if uid not in self._data:
-                self._data[uid] = {}
-            self._data[uid][mid] = rating
-            self._ratedby[mid].append(uid)
+            mids[i] = self._mid[movie]
+        return mids
+
+    @staticmethod
+    def _ids(names, index, n):
+        # ids of names, new names get the next free ids in order of first
+        # appearance; returns the ids and the new number of ids
+        lookup = {}
+        for name in dict.fromkeys(names):
+            i = index.get(name)
+            if i is None:
+                i = index[name] = n
+                n += 1
+            lookup[name] = i
+        return np.fromiter(map(lookup.__getitem__, names), np.int32, len(names)), n
+
+    def add_ratings(self, users, movies, ratings):
+        # bulk form of add_user_data for parallel sequences of user names,
+        # movie names and ratings, merged with one pending array
+        if len(ratings):
+            uids, self._nusers = self._ids(users, self._uid, self._nusers)
+            mids, self._nmovies = self._ids(movies, self._mid, self._nmovies)
+            self._pending.append((uids, mids, np.asarray(ratings)))
+            self._cached_gm = None
+
+    def upsert_user(self, username, data):
+        # unlike add_user_data, the ratings of an existing user are replaced
+        # by data. Runs in time proportional to the ratings of this user
+        store = self._storage
+        if username not in self._uid:
+            self._uid[username] = self._nusers
+            self._nusers += 1
+        uid = self._uid[username]
+        mids = self._movie_ids(list(data))
+        store.resize(self._nusers, self._nmovies)
+        mids, idx = np.unique(mids, return_index=True)
+        store.set_user(uid, mids, np.array(list(data.values()))[idx])
+        self._cached_gm = None
+
+    def upsert_users(self, users):
+        for username, data in users.items():
+            self.upsert_user(username, data)
+
+    def delete_user(self, username):
+        # removes all ratings but keeps the uid of the user, so no ids
+        # change. filter(minratings=1) drops such empty users
+        self._storage.set_user(self._uid[username], [], [])
+        self._cached_gm = None
 
     @staticmethod
     def read_pickle_folder(path, verbose=True):
@@ -71,64 +143,71 @@ class RatingMatrix:
     def to_json(self, path: str):
         # this function was made in 2023 to facilitate writing to json
         # instead of pickle
-        movies = [None] * len(self._mid.inverse)
-        users = [None] * len(self._uid.inverse)
-        for idx, m in self._mid.inverse.items():
-            movies[idx] = m
-        for idx, u in self._uid.inverse.items():
-            users[idx] = u
+        store = self._storage
+        ratings = {}
+        for uid in range(self._nusers):
+            mids, values = store.user(uid)
+            if len(mids):
+                ratings[uid] = dict(zip(mids.tolist(), values.tolist()))
         data = {
-            "movies": movies,
-            "users": users,
-            "ratings": self._data,
+            "movies": self._movie_names(),
+            "users": self._user_names(),
+            "ratings": ratings,
         }
         with open(path, "w") as f:
             json.dump(data, f)
 
+    @classmethod
+    def read_snapshot(cls, path: str) -> "RatingMatrix":
+        # memory maps a binary snapshot, see recsys.snapshot. The rating
+        # arrays are read-only views of the file
+        return read_snapshot(path, cls)
+
+    def to_snapshot(self, path: str):
+        write_snapshot(self, path)
+
     @staticmethod
     def scrape_from_usernames(usernames):
+        import letterboxd_scrape as scrape
+
         obj = RatingMatrix()
         for u in usernames:
             obj.add_user_data(u, scrape.get_ratings(u))
         return obj
 
     def _add_datapoint(self, username, moviename, rating):
-        if username not in self._uid:
-            self._uid[username] = self._nusers
-            self._nusers += 1
-        uid = self._uid[username]
-        if moviename not in self._mid:
-            self._mid[moviename] = self._nmovies
-            self._nmovies += 1
-        mid = self._mid[moviename]
-        if not mid in self._ratedby:
-            self._ratedby[mid] = []
-        self._ratedby[mid].append(uid)
-        if not uid in self._data:
-            self._data[uid] = {}
-        self._data[uid][mid] = rating
+        self.add_user_data(username, {moviename: rating})
 
     @staticmethod
     def read_csv(filename, sep="::"):
-        rm = RatingMatrix()
+        users, movies, ratings = [], [], []
         with open(filename, "r") as f:
-            for line in f.readlines():
+            for line in f:
                 uid, mid, rating, _ = line.split(sep)
-                rm._add_datapoint(
-                    "user{}".format(uid), "movie{}".format(mid), int(rating)
-                )
+                users.append("user" + uid)
+                movies.append("movie" + mid)
+                ratings.append(int(rating))
+        rm = RatingMatrix()
+        rm.add_ratings(users, movies, ratings)
         return rm
 
+    def _user_names(self):
+        return [self._uid.inverse[uid] for uid in range(self._nusers)]
+
+    def _movie_names(self):
+        return [self._mid.inverse[mid] for mid in range(self._nmovies)]
+
     def votes(self, movies=None):
+        counts = self._storage.movie_counts()
         if type(movies) == str:
             moviesit = [self._mid[movies]]
         elif movies is None:
-            moviesit = iter(self._mid.inverse)
+            return dict(enumerate(counts.tolist()))
         else:
             moviesit = (self._mid[movie] for movie in movies)
         result = {}
         for mid in moviesit:
-            result[mid] = len(self._ratedby[mid])
+            result[mid] = int(counts[mid])
         return result
 
     def remove_movie(self, movie):
@@ -140,110 +219,86 @@ class RatingMatrix:
         self._remove_mid(mid)
 
     def _remove_mid(self, mid):
-        del self._mid.inverse[mid]
-        for oldmid in range(mid + 1, self._nmovies):
-            movie = self._mid.inverse[oldmid]
-            newmid = oldmid - 1
-            self._mid[movie] = newmid
-            for uid in self._ratedby[oldmid]:
-                self._data[uid][newmid] = self._data[uid][oldmid]
-                del self._data[uid][oldmid]
-            self._ratedby[newmid] = self._ratedby[oldmid]
-            del self._ratedby[oldmid]
-        self._nmovies -= 1
-
-    def _remove_multiple_mids(self):
-        removed = 0
-        try:
-            while True:
-                to_remove = yield
-                del self._mid.inverse[to_remove]
-                for uid in self._ratedby[to_remove]:
-                    del self._data[uid][to_remove]
-                del self._ratedby[to_remove]
-                removed += 1
-        except GeneratorExit:
-            newmids = []
-            for i in range(self._nmovies):
-                if i in self._mid.inverse:
-                    if newmids:
-                        newmid = newmids.pop(0)
-                        movie = self._mid.inverse[i]
-                        self._mid[movie] = newmid
-                        for uid in self._ratedby[i]:
-                            self._data[uid][newmid] = self._data[uid][i]
-                            del self._data[uid][i]
-                        self._ratedby[newmid] = self._ratedby[i]
-                        del self._ratedby[i]
-                        newmids.append(i)
-                    continue
-                newmids.append(i)
-            self._nmovies -= removed
+        self._remove_mids([mid])
+
+    def _remove_mids(self, mids):
+        keep = np.ones(self._nmovies, dtype=bool)
+        keep[np.asarray(mids, dtype=np.int64)] = False
+        self._take_movies(keep)
+
+    def _take_movies(self, keep):
+        names = self._movie_names()
+        self._store = self._storage.take_movies(keep)
+        kept = (name for name, k in zip(names, keep) if k)
+        self._mid = bidict((name, mid) for mid, name in enumerate(kept))
+        self._nmovies = self._store.nmovies
+        self._cached_gm = None
+
+    def _take_users(self, keep):
+        names = self._user_names()
+        self._store = self._storage.take_users(keep)
+        kept = (name for name, k in zip(names, keep) if k)
+        self._uid = bidict((name, uid) for uid, name in enumerate(kept))
+        self._nusers = self._store.nusers
+        self._cached_gm = None
 
     def global_mean(self, reset_cache=False):
         if self._cached_gm is not None and not reset_cache:
             return self._cached_gm
-        gm = 0
-        i = 0
-        for uid, d in self._data.items():
-            for mid, r in d.items():
-                gm += r
-                i += 1
-        self._cached_gm = gm / i
+        store = self._storage
+        self._cached_gm = store.total() / store.nnz
         return self._cached_gm
 
     def copy(self):
         copy = RatingMatrix()
-        copy._data = deepcopy(self._data)
+        copy._store = self._store.copy()
+        copy._pending = list(self._pending)
         copy._mid = self._mid.copy()
         copy._uid = self._uid.copy()
-        copy._ratedby = self._ratedby.copy()
         copy._nusers = self._nusers
         copy._nmovies = self._nmovies
         copy._cached_gm = self._cached_gm
         return copy
 
-    def filter(self, topviewed=None, minvotes=None, maxvotes=None, inplace=False):
+    def filter(
+        self,
+        topviewed=None,
+        minvotes=None,
+        maxvotes=None,
+        exclude=None,
+        minratings=None,
+        inplace=False,
+    ):
+        # all movie criteria are evaluated on the vote counts before filtering.
+        # minratings then drops users with too few ratings left, without
+        # recomputing the votes of the remaining movies
         if inplace:
             frm = self
         else:
             frm = self.copy()
-        v = frm.votes()
+        v = frm._storage.movie_counts()
 
+        keep = np.ones(frm._nmovies, dtype=bool)
         if minvotes is not None:
-            cor = frm._remove_multiple_mids()
-            cor.__next__()
-            for mid in range(self._nmovies):
-                if v[mid] < minvotes:
-                    cor.send(mid)
-            cor.close()
-
-        """
-        if topviewed is not None:
-            v = frm.votes()
-            s = sorted(frm._mid.inverse.keys(), key = lambda x: v[x], reverse=True)[:topviewed]
-            print(len(s))
-            to_remove = [frm._mid.inverse[mid] for mid in range(frm._nmovies) if mid not in s]
-            print(len(to_remove))
-            for movie in to_remove:    
-                frm._remove_mid(frm._mid[movie])
-        
-        if minvotes is not None:
-            i = 0
-            while i < frm._nmovies:
-                if Movie(frm, i).votes() >= minvotes:
-                    i += 1
-                else:
-                    frm._remove_mid(i)
-        
+            keep &= v >= minvotes
         if maxvotes is not None:
-            i = 0
-            while i < frm._nmovies:
-                if Movie(frm, i).votes() <= maxvotes:
-                    i += 1
-                else:
-                    frm._remove_mid(i)
-        """
+            keep &= v <= maxvotes
+        if exclude is not None:
+            excluded = [frm._mid[movie] for movie in exclude if movie in frm._mid]
+            keep[excluded] = False
+        if topviewed is not None and keep.sum() > topviewed:
+            candidates = np.flatnonzero(keep)
+            order = np.argsort(-v[candidates], kind="stable")
+            keep[:] = False
+            keep[candidates[order[:topviewed]]] = True
+
+        if not keep.all():
+            frm._take_movies(keep)
+        if minratings is not None:
+            watched = frm._storage.user_counts()
+            if (watched < minratings).any():
+                frm._take_users(watched >= minratings)
+
         if not inplace:
             return frm
 
@@ -262,20 +317,24 @@ class RatingMatrix:
         return Movie(self, mid)
 
     def sparsity(self):
-        v = self.votes()
-        return sum(v[x] for x in range(self._nmovies)) / (self._nusers * self._nmovies)
+        return self._storage.nnz / (self._nusers * self._nmovies)
 
     def rescale(self, targetscale=5):
-        for uid in self._data:
-            for mid in self._data[uid]:
-                self._data[uid][mid] = self._data[uid][mid] / 2
+        store = self._storage.astype(np.float32)
+        store.values /= 2
+        store.mvalues /= 2
+        self._store = store
+        self._cached_gm = None
 
     @property
     def top(self):
-        pairs = [
-            (self._mid.inverse[mid], Movie(self, mid).global_rating())
-            for mid in self._mid.inverse
-        ]
+        _, mids, values = self._storage.coo()
+        votes = self._storage.movie_counts()
+        sums = np.bincount(mids, weights=values, minlength=self._nmovies)
+        means = np.divide(sums, votes, out=np.zeros(self._nmovies), where=votes > 0)
+        w = votes / self._nusers
+        ratings = w * means + (1 - w) * self.global_mean()
+        pairs = list(zip(self._movie_names(), ratings.tolist()))
         return sorted(pairs, key=lambda x: x[1], reverse=True)
 
     def print_top(self, arg):
@@ -1,11 +1,21 @@
+import numba
 import numpy as np
 from random import sample
 import math
+from functools import partial
 from timeit import default_timer
 
 from recsys.foreigner import Foreigner
+from recsys.storage import RatingStorage
+from recsys.als import _als_train
+from recsys.similarity import SimilarityIndex
 
-from recsys.fast_methods import _fast_predict, _fast_train, _fast_validation_metrics
+from recsys.fast_methods import (
+    _fast_predict,
+    _fast_train,
+    _fast_train_parallel,
+    _fast_validation_metrics,
+)
 
 
 class RecSys:
@@ -15,7 +25,7 @@ class RecSys:
         self._nmovies = rm._nmovies
         self._foreigners = set()
         self._nf = nfactors
-        self._test = set()
+        self._test = np.empty(0, dtype=np.int64)
         self._U = None
         self._M = None
         self._user_bias = None
@@ -26,12 +36,14 @@ class RecSys:
     def set_foreigners(self, perc):
         self._foreigners = set(sample(range(self._nusers), int(perc * self._nusers)))
 
+    def _foreigner_mask(self, uids):
+        return np.isin(uids, np.fromiter(self._foreigners, dtype=np.int64))
+
     def set_testset(self, perc):
-        aux = []
-        for uid in self._rm._data:
-            if not uid in self._foreigners:
-                aux += [(uid, mid) for mid in self._rm._data[uid]]
-        self._test = set(sample(aux, int(perc * len(aux))))
+        # the testset is stored as positions in the user-major rating arrays
+        uids, _, _ = self._rm._storage.coo()
+        aux = np.flatnonzero(~self._foreigner_mask(uids))
+        self._test = np.sort(np.random.choice(aux, int(perc * len(aux)), replace=False))
 
     def _predict(self, uid, mid):
         return _fast_predict(
@@ -50,25 +62,136 @@ class RecSys:
         self._movie_bias = np.zeros(self._nmovies)
 
     def trainset(self):
-        for uid in range(self._nusers):
-            if uid in self._foreigners:
-                continue
-            for mid, rating in self._rm._data.get(uid, {}).items():
-                if (uid, mid) in self._test:
-                    continue
-                yield uid, mid, rating
+        yield from ((int(u), int(m), r) for u, m, r in self.numpy_trainset())
 
     def testset(self):
-        for uid, mid in self._test:
-            yield uid, mid, self._rm._data[uid][mid]
+        yield from ((int(u), int(m), r) for u, m, r in self.numpy_testset())
+
+    def _numpy_ratings(self, keep):
+        uids, mids, ratings = self._rm._storage.coo()
+        result = np.empty((int(keep.sum()), 3))
+        result[:, 0] = uids[keep]
+        result[:, 1] = mids[keep]
+        result[:, 2] = ratings[keep]
+        return result
 
     def numpy_trainset(self):
-        return np.array(list(self.trainset()))
+        uids, _, _ = self._rm._storage.coo()
+        keep = ~self._foreigner_mask(uids)
+        keep[self._test] = False
+        return self._numpy_ratings(keep)
 
     def numpy_testset(self):
-        return np.array(list(self.testset()))
+        keep = np.zeros(self._rm._storage.nnz, dtype=bool)
+        keep[self._test] = True
+        return self._numpy_ratings(keep)
+
+    def train(
+        self,
+        epochs=200,
+        shuffle=False,
+        verbose=True,
+        time=True,
+        parallel=False,
+        threads=None,
+        callback=None,
+        validate=False,
+    ):
+        # parallel=True runs lock-free SGD on threads threads (default: all
+        # numba threads). Results are not bit-identical to the serial kernel.
+        # callback is called after every epoch with the dict of _epoch_stats,
+        # validate=True adds the rmse on the testset to it. Training stops
+        # early when the callback returns True; callback=history.append
+        # collects the stats. With neither callback nor verbose all epochs run in
+        # one kernel call
+        if self._U is None:
+            if verbose:
+                print("initializing")
+            self.initialize()
+
+        if time:
+            start = default_timer()
+
+        trainset = self.numpy_trainset()
+        trainset = trainset[np.random.permutation(trainset.shape[0])]
+        losses = np.zeros(epochs)
+        kernel = _fast_train
+        # set_num_threads holds for the calling thread, so it is restored for
+        # the kernels that run after training
+        previous_threads = numba.get_num_threads()
+        if parallel:
+            if threads is None:
+                threads = numba.config.NUMBA_NUM_THREADS
+            numba.set_num_threads(threads)
+            kernel = partial(_fast_train_parallel, threads=threads)
+        testset = self.numpy_testset() if validate else None
+
+        def run(n, losses):
+            self._U, self._M, self._user_bias, self._movie_bias = kernel(
+                n,
+                trainset,
+                self._user_bias,
+                self._movie_bias,
+                self._U,
+                self._M,
+                self._rm.global_mean(),
+                self._lr,
+                self._reg,
+                shuffle,
+                losses,
+            )
+
+        try:
+            if callback is None and not verbose:
+                run(epochs, losses)
+            else:
+                for epoch in range(epochs):
+                    epoch_start = default_timer()
+                    run(1, losses[epoch:])
+                    stats = self._epoch_stats(
+                        epoch,
+                        losses[epoch],
+                        default_timer() - epoch_start,
+                        trainset.shape[0],
+                        testset,
+                    )
+                    if verbose:
+                        print(_format_stats(stats))
+                    if callback is not None and callback(stats):
+                        break
+        finally:
+            numba.set_num_threads(previous_threads)
+
+        if time:
+            return default_timer() - start
+
+    def _epoch_stats(self, epoch, loss, seconds, N, testset):
+        stats = {
+            "epoch": epoch,
+            "loss": float(loss),
+            "rmse": None,
+            "seconds": seconds,
+            "ratings_per_second": N / seconds,
+            "user_norm": float(np.linalg.norm(self._U)),
+            "movie_norm": float(np.linalg.norm(self._M)),
+            "user_bias_norm": float(np.linalg.norm(self._user_bias)),
+            "movie_bias_norm": float(np.linalg.norm(self._movie_bias)),
+        }
+        if testset is not None and testset.shape[0]:
+            stats["rmse"] = _fast_validation_metrics(
+                testset,
+                self._U,
+                self._M,
+                self._user_bias,
+                self._movie_bias,
+                self._rm.global_mean(),
+                self._nf,
+            )[0]
+        return stats
 
-    def train(self, epochs=200, shuffle=False, verbose=True, time=True):
+    def train_als(self, sweeps=15, verbose=True, time=True):
+        # alternating least squares on the same model and objective as
+        # train, usually converged after 10-20 sweeps
         if self._U is None:
             if verbose:
                 print("initializing")
@@ -78,17 +201,23 @@ class RecSys:
             start = default_timer()
 
         trainset = self.numpy_trainset()
-        self._U, self._M, self._user_bias, self._movie_bias = _fast_train(
-            epochs,
-            trainset,
+        storage = RatingStorage.from_coo(
+            trainset[:, 0],
+            trainset[:, 1],
+            trainset[:, 2],
+            self._nusers,
+            self._nmovies,
+            dtype=np.float64,
+        )
+        self._U, self._M, self._user_bias, self._movie_bias = _als_train(
+            sweeps,
+            storage,
             self._user_bias,
             self._movie_bias,
             self._U,
             self._M,
             self._rm.global_mean(),
-            self._lr,
             self._reg,
-            shuffle,
             verbose,
         )
 
@@ -113,36 +242,26 @@ class RecSys:
             print("mae  :", mae)
         return rmse, mae, mse
 
-    def _movie_cosine_similarity(self, mid1, mid2):
-        vector1 = self._M[mid1]
-        vector2 = self._M[mid2]
-
-        return np.dot(vector1, vector2) / (
-            np.linalg.norm(vector1) * np.linalg.norm(vector2)
-        )
-
-    def similar_movies(self, moviename, show_top=10):
-        mid = self._rm._mid.get(moviename, False)
-        if not mid:
+    def similar_movies(self, moviename, show_top=10, verbose=True):
+        if moviename not in self._rm._mid:
             raise ValueError("Movie {} not in data".format(moviename))
-        movie_similarity = []
-        for omid in range(self._nmovies):
-            if mid != omid:
-                name = self._rm._mid.inverse[omid]
-                movie_similarity.append(
-                    (name, self._movie_cosine_similarity(mid, omid))
-                )
-        movie_similarity = sorted(movie_similarity, key=lambda x: x[1], reverse=True)[
-            :show_top
+        neighbours, scores = SimilarityIndex(self._M).query(
+            self._rm._mid[moviename], show_top
+        )
+        movie_similarity = [
+            (self._rm._mid.inverse[omid], score)
+            for omid, score in zip(neighbours.tolist(), scores.tolist())
         ]
 
-        name_length = max(len(x[0]) for x in movie_similarity)
-        print("name".ljust(name_length + 3), "cosine similarity")
-        print(
-            "-------------------------------------------------------------------------------"
-        )
-        for x in movie_similarity:
-            print(x[0].ljust(name_length + 3), f"{x[1]:.2f}")
+        if verbose:
+            name_length = max(len(x[0]) for x in movie_similarity)
+            print("name".ljust(name_length + 3), "cosine similarity")
+            print(
+                "-------------------------------------------------------------------------------"
+            )
+            for x in movie_similarity:
+                print(x[0].ljust(name_length + 3), f"{x[1]:.2f}")
+        return movie_similarity
 
     def inspect_feature(self, n, top=10):
         aux = np.hstack((np.asmatrix(range(self._rm._nmovies)).transpose(), self._M))
@@ -183,9 +302,8 @@ class RecSys:
         if verbose:
             print("foreigners trained")
         for i, mid in testset:
-            total += (
-                self._rm._data[self._rm._uid[fs[i]._username]][mid] - fs[i].predict(mid)
-            ) ** 2
+            uid = self._rm._uid[fs[i]._username]
+            total += (self._rm._storage.rating(uid, mid) - fs[i].predict(mid)) ** 2
         return math.sqrt(total / K)
         for uid in self._foreigners:
             f = Foreigner.from_ratingmatrix(self, uid)
@@ -196,3 +314,37 @@ class RecSys:
             if verbose:
                 print("foreigner", uid, "rmse:", rmse)
         return total / N
+
+
+def _format_stats(stats):
+    rmse = "-" if stats["rmse"] is None else "{:.4f}".format(stats["rmse"])
+    return (
+        "epoch {epoch:4d}  loss {loss:.4f}  rmse {rmse}  {rate:.2e} ratings/s  "
+        "|U| {user_norm:.2f}  |M| {movie_norm:.2f}".format(
+            **dict(stats, rmse=rmse, rate=stats["ratings_per_second"])
+        )
+    )
+
+
+def early_stopping(patience=5, min_delta=1e-4, key="loss"):
+    # callback for RecSys.train that stops once stats[key] did not improve
+    # by min_delta for patience epochs; key="rmse" needs train(validate=True)
+    # and a testset
+    best = math.inf
+    stalled = 0
+
+    def callback(stats):
+        nonlocal best, stalled
+        if stats[key] is None:
+            raise ValueError(
+                "early stopping on {} needs train(validate=True) and a "
+                "non-empty testset".format(key)
+            )
+        if stats[key] < best - min_delta:
+            best = stats[key]
+            stalled = 0
+        else:
+            stalled += 1
+        return stalled >= patience
+
+    return callback
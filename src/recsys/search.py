@@ -0,0 +1,218 @@
+"""
+Hyperparameter search over nfactors, lr and reg of RecSys.
+
+The train and test arrays of a filtered rating matrix are put in shared
+memory once; trials run on a process pool and map them without copying.
+Every trial trains with SGD, checks the test RMSE every ``check_every``
+epochs and gives up when it is ``tolerance`` worse than the best finished
+trial at the same epoch. The results are written as a csv table, best
+first.
+
+Search a snapshot from the src directory with
+``python -m recsys.search raw_ratings.rms grid`` or
+``python -m recsys.search raw_ratings.rms random 20``.
+"""
+import csv
+import itertools
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from timeit import default_timer
+
+import numpy as np
+
+RESULT_FIELDS = (
+    "nfactors",
+    "lr",
+    "reg",
+    "rmse",
+    "mae",
+    "epochs",
+    "abandoned",
+    "seconds",
+)
+
+
+def grid(nfactors=(50, 100, 150), lr=(0.001, 0.005), reg=(0.02, 0.05, 0.1)):
+    return [
+        {"nfactors": n, "lr": l, "reg": r}
+        for n, l, r in itertools.product(nfactors, lr, reg)
+    ]
+
+
+def random_trials(n, nfactors=(20, 200), lr=(0.0005, 0.01), reg=(0.005, 0.2), seed=0):
+    # nfactors uniform, lr and reg log-uniform between the bounds
+    rng = np.random.default_rng(seed)
+    log_uniform = lambda lo, hi: float(np.exp(rng.uniform(np.log(lo), np.log(hi))))
+    return [
+        {
+            "nfactors": int(rng.integers(nfactors[0], nfactors[1] + 1)),
+            "lr": log_uniform(*lr),
+            "reg": log_uniform(*reg),
+        }
+        for _ in range(n)
+    ]
+
+
+def _share(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+_worker = {}
+
+
+def _init_worker(train, test, nusers, nmovies, global_mean, threads):
+    import numba
+
+    numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+    for key, (name, shape, dtype) in (("train", train), ("test", test)):
+        shm = shared_memory.SharedMemory(name=name)
+        _worker[key + "_shm"] = shm
+        _worker[key] = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+    _worker.update(
+        nusers=nusers, nmovies=nmovies, global_mean=global_mean, threads=threads
+    )
+
+
+def _run_trial(params, epochs, check_every, reference, tolerance, seed):
+    from recsys.fast_methods import (
+        _fast_train,
+        _fast_train_parallel,
+        _fast_validation_metrics,
+    )
+
+    w = _worker
+    nf, lr, reg = params["nfactors"], params["lr"], params["reg"]
+    rng = np.random.default_rng(seed)
+    U = rng.normal(0, 0.01, (w["nusers"], nf))
+    M = rng.normal(0, 0.01, (w["nmovies"], nf))
+    user_bias = np.zeros(w["nusers"])
+    movie_bias = np.zeros(w["nmovies"])
+
+    start = default_timer()
+    curve = []
+    abandoned = False
+    while len(curve) * check_every < epochs:
+        n = min(check_every, epochs - len(curve) * check_every)
+        args = (n, w["train"], user_bias, movie_bias, U, M, w["global_mean"])
+        args += (lr, reg, False, np.zeros(n))
+        if w["threads"] > 1:
+            U, M, user_bias, movie_bias = _fast_train_parallel(*args, w["threads"])
+        else:
+            U, M, user_bias, movie_bias = _fast_train(*args)
+        rmse, mae, _ = _fast_validation_metrics(
+            w["test"], U, M, user_bias, movie_bias, w["global_mean"], nf
+        )
+        curve.append(rmse)
+        k = len(curve) - 1
+        if k < len(reference) and rmse > reference[k] * (1 + tolerance):
+            abandoned = True
+            break
+    result = dict(params, rmse=curve[-1], mae=mae, abandoned=abandoned)
+    result["epochs"] = min(len(curve) * check_every, epochs)
+    result["seconds"] = default_timer() - start
+    return result, curve
+
+
+def search(
+    rm,
+    trials,
+    epochs=50,
+    check_every=5,
+    test_fraction=0.1,
+    processes=None,
+    threads=1,
+    tolerance=0.02,
+    seed=0,
+    path="search_results.csv",
+    verbose=True,
+):
+    # runs trials (dicts with nfactors, lr and reg) on rm and returns the
+    # results sorted by test rmse; every trial uses the same test set
+    from recsys.rec import RecSys
+
+    np.random.seed(seed)
+    model = RecSys(rm)
+    model.set_testset(test_fraction)
+    # shuffled once here, the workers only read the shared trainset
+    trainset = model.numpy_trainset()
+    train_shm, train = _share(trainset[np.random.permutation(trainset.shape[0])])
+    test_shm, test = _share(model.numpy_testset())
+    if processes is None:
+        processes = max(1, (os.cpu_count() or 1) // threads)
+
+    results = []
+    best = []
+    try:
+        with ProcessPoolExecutor(
+            processes,
+            initializer=_init_worker,
+            initargs=(train, test, rm._nusers, rm._nmovies, rm.global_mean(), threads),
+        ) as pool:
+            queue = list(trials)
+            running = set()
+            while queue or running:
+                # trials start with the best curve known at that moment
+                while queue and len(running) < processes:
+                    running.add(
+                        pool.submit(
+                            _run_trial,
+                            queue.pop(0),
+                            epochs,
+                            check_every,
+                            best,
+                            tolerance,
+                            seed,
+                        )
+                    )
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result, curve = future.result()
+                    results.append(result)
+                    if not result["abandoned"] and (
+                        not best or curve[-1] < best[len(curve) - 1]
+                    ):
+                        best = curve
+                    if verbose:
+                        print(_format(result))
+    finally:
+        for shm in (train_shm, test_shm):
+            shm.close()
+            shm.unlink()
+
+    results.sort(key=lambda r: (r["abandoned"], r["rmse"]))
+    if path is not None:
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    return results
+
+
+def _format(result):
+    return (
+        "nfactors {nfactors:4d}  lr {lr:.5f}  reg {reg:.4f}  rmse {rmse:.4f}  "
+        "mae {mae:.4f}  epochs {epochs:4d}{abandoned}  {seconds:7.1f}s".format(
+            **dict(result, abandoned=" abandoned" if result["abandoned"] else "")
+        )
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[2] not in ("grid", "random"):
+        print("usage: python -m recsys.search SNAPSHOT grid|random [TRIALS]")
+        sys.exit(1)
+    from recsys.rating_matrix import RatingMatrix
+
+    rm = RatingMatrix.read_snapshot(sys.argv[1])
+    rm.filter(minvotes=50, inplace=True)
+    if sys.argv[2] == "grid":
+        trials = grid()
+    else:
+        trials = random_trials(int(sys.argv[3]) if len(sys.argv) > 3 else 20)
+    print("\nbest first:")
+    for result in search(rm, trials):
+        print(_format(result))
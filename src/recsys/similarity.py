@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def _top_k_rows(S, k):
+    # column indices and values of the k largest entries of every row,
+    # largest first
+    k = min(k, S.shape[1])
+    part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(S, part, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return (
+        np.take_along_axis(part, order, axis=1),
+        np.take_along_axis(values, order, axis=1),
+    )
+
+
+class SimilarityIndex:
+    # cosine similarity between the movie vectors of a factor matrix. the
+    # vectors are normalized once, so a similarity is a single dot product.
+    # precompute stores the k nearest neighbours of every movie, after that
+    # queries with at most k neighbours are plain lookups
+
+    def __init__(self, M=None, k=None, block=512):
+        self._vectors = None
+        self._neighbours = None
+        self._scores = None
+        if M is not None:
+            norms = np.linalg.norm(M, axis=1, keepdims=True)
+            self._vectors = np.divide(
+                M, norms, out=np.zeros(M.shape), where=norms > 0
+            ).astype(np.float32)
+        if k is not None:
+            self.precompute(k, block)
+
+    @classmethod
+    def from_arrays(cls, vectors, neighbours=None, scores=None):
+        obj = cls()
+        obj._vectors = vectors
+        obj._neighbours = neighbours
+        obj._scores = scores
+        return obj
+
+    @property
+    def k(self):
+        return 0 if self._neighbours is None else self._neighbours.shape[1]
+
+    def _compute(self, mids, k):
+        S = self._vectors[mids] @ self._vectors.T
+        S[np.arange(len(mids)), mids] = -np.inf
+        neighbours, scores = _top_k_rows(S, k)
+        return neighbours.astype(np.int32), scores
+
+    def precompute(self, k, block=512):
+        # blocked over the rows, so memory stays at block x nmovies
+        n = len(self._vectors)
+        k = min(k, n - 1)
+        self._neighbours = np.empty((n, k), dtype=np.int32)
+        self._scores = np.empty((n, k), dtype=np.float32)
+        for start in range(0, n, block):
+            mids = np.arange(start, min(n, start + block))
+            self._neighbours[mids], self._scores[mids] = self._compute(mids, k)
+
+    def query(self, mids, k=10):
+        # neighbours and similarities of one movie id (1d arrays) or of a
+        # sequence of movie ids (one row per movie)
+        single = np.ndim(mids) == 0
+        mids = np.atleast_1d(np.asarray(mids, dtype=np.int64))
+        if k <= self.k:
+            neighbours, scores = self._neighbours[mids, :k], self._scores[mids, :k]
+        else:
+            neighbours, scores = self._compute(mids, k)
+        if single:
+            return neighbours[0], scores[0]
+        return neighbours, scores
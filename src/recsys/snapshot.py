@@ -0,0 +1,241 @@
+"""
+Binary snapshot formats for rating matrices and trained models.
+
+Layout of a snapshot file (all integers little-endian):
+
+    8 bytes   magic, b"RMSNAP\0\0" for rating matrices and b"TMSNAP\0\0"
+              for trained models
+    4 bytes   format version
+    4 bytes   length of the json header
+    n bytes   json header: scalars and for every array its dtype, shape and
+              offset relative to the data section
+    ...       data section, starting at the first 64 byte boundary after
+              the header; every array is 64 byte aligned
+
+A rating matrix snapshot holds the six arrays of a RatingStorage plus the
+user and movie names as newline separated utf-8 string tables. A model
+snapshot holds the factor matrix, the movie biases, the movie names with
+their indices and optionally the similarity index. Reading maps the file
+once with np.memmap and hands out read-only views, so opening a snapshot
+does not depend on its size and processes reading the same file share its
+pages.
+
+Convert the existing sources with
+``python -m recsys.snapshot ratings raw_ratings.json raw_ratings.rms``
+(a folder of pickles works as source too) and
+``python -m recsys.snapshot model model.json model.bin``
+(or a pickled model).
+"""
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+from bidict import bidict
+
+from recsys.storage import RatingStorage
+
+MAGIC = b"RMSNAP\0\0"
+MODEL_MAGIC = b"TMSNAP\0\0"
+VERSION = 1
+ALIGN = 64
+STORAGE_ARRAYS = ("indptr", "indices", "values", "mindptr", "mindices", "mvalues")
+
+
+def _align(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def _string_table(names):
+    return np.frombuffer("\n".join(names).encode("utf-8"), dtype=np.uint8)
+
+
+def _read_string_table(array):
+    if len(array) == 0:
+        return []
+    return array.tobytes().decode("utf-8").split("\n")
+
+
+def write_arrays(path, header, arrays, magic=MAGIC):
+    header = dict(header, arrays={})
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + array.nbytes)
+    raw_header = json.dumps(header).encode("utf-8")
+
+    # written next to path and moved in place, so that processes mapping
+    # the old file keep reading it
+    with open(path + ".tmp", "wb") as f:
+        f.write(magic)
+        f.write(struct.pack("<II", VERSION, len(raw_header)))
+        f.write(raw_header)
+        base = _align(f.tell())
+        for name, array in arrays.items():
+            f.seek(base + header["arrays"][name]["offset"])
+            array.tofile(f)
+    os.replace(path + ".tmp", path)
+
+
+def read_header(path, magic=MAGIC):
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("{} is not a {} snapshot".format(path, magic[:6]))
+        version, length = struct.unpack("<II", f.read(8))
+        if version != VERSION:
+            raise ValueError(
+                "Unsupported snapshot version {} in {}".format(version, path)
+            )
+        header = json.loads(f.read(length).decode("utf-8"))
+    header["base"] = _align(len(magic) + 8 + length)
+    return header
+
+
+def read_arrays(path, magic=MAGIC):
+    header = read_header(path, magic)
+    buf = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        start = header["base"] + info["offset"]
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays[name] = buf[start : start + size].view(dtype).reshape(shape)
+    return header, arrays
+
+
+def write_snapshot(rm, path):
+    store = rm._storage
+    store.compact()
+    arrays = {name: getattr(store, name) for name in STORAGE_ARRAYS}
+    arrays["users"] = _string_table(rm._user_names())
+    arrays["movies"] = _string_table(rm._movie_names())
+    header = {
+        "nusers": rm._nusers,
+        "nmovies": rm._nmovies,
+        "global_mean": rm.global_mean() if store.nnz else None,
+    }
+    write_arrays(path, header, arrays)
+
+
+def read_snapshot(path, cls=None):
+    if cls is None:
+        from recsys.rating_matrix import RatingMatrix as cls
+
+    header, arrays = read_arrays(path)
+    store = RatingStorage.from_csr(
+        header["nusers"], header["nmovies"], *(arrays[name] for name in STORAGE_ARRAYS)
+    )
+
+    rm = cls()
+    rm._store = store
+    rm._nusers = header["nusers"]
+    rm._nmovies = header["nmovies"]
+    rm._uid = bidict(zip(_read_string_table(arrays["users"]), range(rm._nusers)))
+    rm._mid = bidict(zip(_read_string_table(arrays["movies"]), range(rm._nmovies)))
+    rm._cached_gm = header["global_mean"]
+    return rm
+
+
+def convert(source, path, verbose=False):
+    from recsys.rating_matrix import RatingMatrix
+
+    if os.path.isdir(source):
+        rm = RatingMatrix.read_pickle_folder(source, verbose=verbose)
+    else:
+        rm = RatingMatrix.read_json(source)
+    write_snapshot(rm, path)
+    return rm
+
+
+def write_model(model, path):
+    # the movie names are stored in the iteration order of _movie_indices,
+    # which decides ties between recommendations
+    arrays = {
+        "matrix": model._M,
+        "bias": model._b,
+        "movies": _string_table(list(model._movie_indices)),
+        "indices": np.fromiter(model._movie_indices.values(), dtype=np.int32),
+    }
+    similarity = model._similarity
+    if similarity is not None and similarity.k:
+        arrays["similar_vectors"] = similarity._vectors
+        arrays["similar_neighbours"] = similarity._neighbours
+        arrays["similar_scores"] = similarity._scores
+    header = {
+        "lr": float(model._lr),
+        "reg": float(model._reg),
+        "gm": float(model._global_mean),
+    }
+    write_arrays(path, header, arrays, MODEL_MAGIC)
+
+
+def read_model(path, cls=None):
+    from recsys.similarity import SimilarityIndex
+
+    if cls is None:
+        from recsys.trained import TrainedModel as cls
+
+    header, arrays = read_arrays(path, MODEL_MAGIC)
+    model = cls()
+    names = _read_string_table(arrays["movies"])
+    model._movie_indices = dict(zip(names, arrays["indices"].tolist()))
+    model._M = arrays["matrix"]
+    model._b = arrays["bias"]
+    model._lr = header["lr"]
+    model._reg = header["reg"]
+    model._global_mean = header["gm"]
+    if "similar_vectors" in arrays:
+        model._similarity = SimilarityIndex.from_arrays(
+            arrays["similar_vectors"],
+            arrays["similar_neighbours"],
+            arrays["similar_scores"],
+        )
+    return model
+
+
+def convert_model(source, path):
+    from recsys.trained import TrainedModel
+
+    if source.endswith(".pkl"):
+        model = TrainedModel.load_pkl(source)
+    else:
+        model = TrainedModel.read_json(source)
+    write_model(model, path)
+    return model
+
+
+def update(folder, path, verbose=False):
+    # upserts the users of a pickle folder whose file changed after the
+    # snapshot was written, then replaces the snapshot
+    import pickle
+
+    rm = read_snapshot(path)
+    since = os.path.getmtime(path)
+    for filename in os.listdir(folder):
+        filepath = os.path.join(folder, filename)
+        if os.path.getmtime(filepath) <= since:
+            continue
+        with open(filepath, "rb") as f:
+            rm.upsert_user(filename.split(".")[0], pickle.load(f))
+        if verbose:
+            print("updated", filename)
+    write_snapshot(rm, path)
+    return read_snapshot(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("ratings", "model"):
+        print("usage: python -m recsys.snapshot ratings|model SOURCE DESTINATION")
+        sys.exit(1)
+    if sys.argv[1] == "ratings":
+        convert(sys.argv[2], sys.argv[3], verbose=True)
+    else:
+        convert_model(sys.argv[2], sys.argv[3])
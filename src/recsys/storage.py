@@ -0,0 +1,352 @@
+import numpy as np
+
+
+def rating_dtype(ratings):
+    # letterboxd ratings are the integers 1..10, which fit in a single byte.
+    # anything else (e.g. rescaled ratings) is stored as float32
+    ratings = np.asarray(ratings)
+    if ratings.size == 0:
+        return np.dtype(np.uint8)
+    if np.issubdtype(ratings.dtype, np.integer):
+        if ratings.min() >= 0 and ratings.max() <= 255:
+            return np.dtype(np.uint8)
+    return np.dtype(np.float32)
+
+
+def _counts_to_indptr(counts):
+    indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr
+
+
+def _positions(start, count):
+    # buffer positions of all entries of the segments, in segment order
+    offsets = _counts_to_indptr(count)
+    return np.repeat(start - offsets[:-1], count) + np.arange(offsets[-1])
+
+
+def _grow(array, size):
+    # amortized growth of an array to hold at least size elements
+    if len(array) >= size:
+        return array
+    new = np.zeros(max(size, 2 * len(array), 16), dtype=array.dtype)
+    new[: len(array)] = array
+    return new
+
+
+class RatingStorage:
+    # Sparse ratings held twice in contiguous arrays: a user-major (CSR) view
+    # with the movie ids per user and a movie-major (CSC) view with the user
+    # ids per movie. Within a user (movie) the movie (user) ids are sorted.
+    #
+    # Every user and movie owns a segment (start, count, capacity) of the
+    # buffers. Freshly built storage is compact: the segments are laid out
+    # in id order without gaps, so the starts are plain CSR/CSC pointers.
+    # set_user only shifts or moves the segments it touches; a segment that
+    # outgrows its capacity moves to the end of the buffer. compact()
+    # restores the dense layout and runs by itself once half of a buffer is
+    # slack, which keeps updates amortized O(1) per rating.
+
+    def __init__(self, nusers=0, nmovies=0, dtype=np.uint8):
+        self.nusers = nusers
+        self.nmovies = nmovies
+        self.ustart = np.zeros(nusers, dtype=np.int64)
+        self.ucount = np.zeros(nusers, dtype=np.int64)
+        self.ucap = np.zeros(nusers, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self.values = np.empty(0, dtype=dtype)
+        self.mstart = np.zeros(nmovies, dtype=np.int64)
+        self.mcount = np.zeros(nmovies, dtype=np.int64)
+        self.mcap = np.zeros(nmovies, dtype=np.int64)
+        self.mindices = np.empty(0, dtype=np.int32)
+        self.mvalues = np.empty(0, dtype=dtype)
+        self._uend = 0
+        self._mend = 0
+        self._nnz = 0
+        self._sum = 0.0
+        self._compact = True
+
+    @classmethod
+    def from_csr(
+        cls, nusers, nmovies, indptr, indices, values, mindptr, mindices, mvalues
+    ):
+        obj = cls(nusers, nmovies, values.dtype)
+        obj.ustart = np.asarray(indptr[:-1], dtype=np.int64)
+        obj.ucount = np.diff(indptr)
+        obj.ucap = obj.ucount.copy()
+        obj.indices = indices
+        obj.values = values
+        obj.mstart = np.asarray(mindptr[:-1], dtype=np.int64)
+        obj.mcount = np.diff(mindptr)
+        obj.mcap = obj.mcount.copy()
+        obj.mindices = mindices
+        obj.mvalues = mvalues
+        obj._uend = obj._mend = obj._nnz = len(indices)
+        obj._sum = None
+        return obj
+
+    @classmethod
+    def from_coo(cls, uids, mids, ratings, nusers, nmovies, dtype=None):
+        # when a (uid, mid) pair occurs more than once, the last one wins
+        uids = np.asarray(uids, dtype=np.int32)
+        mids = np.asarray(mids, dtype=np.int32)
+        if dtype is None:
+            dtype = rating_dtype(ratings)
+        ratings = np.asarray(ratings).astype(dtype, copy=False)
+
+        # lexsort is stable, so duplicates keep their insertion order
+        order = np.lexsort((mids, uids))
+        uids, mids, ratings = uids[order], mids[order], ratings[order]
+        if len(order) > 1:
+            last = np.ones(len(order), dtype=bool)
+            last[:-1] = (uids[1:] != uids[:-1]) | (mids[1:] != mids[:-1])
+            if not last.all():
+                uids, mids, ratings = uids[last], mids[last], ratings[last]
+
+        morder = np.argsort(mids, kind="stable")
+        return cls.from_csr(
+            nusers,
+            nmovies,
+            _counts_to_indptr(np.bincount(uids, minlength=nusers)),
+            mids,
+            ratings,
+            _counts_to_indptr(np.bincount(mids, minlength=nmovies)),
+            uids[morder],
+            ratings[morder],
+        )
+
+    @property
+    def nnz(self):
+        return self._nnz
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def indptr(self):
+        self.compact()
+        return _counts_to_indptr(self.user_counts())
+
+    @property
+    def mindptr(self):
+        self.compact()
+        return _counts_to_indptr(self.movie_counts())
+
+    def user(self, uid):
+        start = self.ustart[uid]
+        stop = start + self.ucount[uid]
+        return self.indices[start:stop], self.values[start:stop]
+
+    def movie(self, mid):
+        start = self.mstart[mid]
+        stop = start + self.mcount[mid]
+        return self.mindices[start:stop], self.mvalues[start:stop]
+
+    def rating(self, uid, mid):
+        mids, ratings = self.user(uid)
+        pos = np.searchsorted(mids, mid)
+        if pos == len(mids) or mids[pos] != mid:
+            raise KeyError((uid, mid))
+        return ratings[pos]
+
+    def user_counts(self):
+        return self.ucount[: self.nusers]
+
+    def movie_counts(self):
+        return self.mcount[: self.nmovies]
+
+    def user_ids(self):
+        # the uid belonging to every entry of the user-major view
+        self.compact()
+        return np.repeat(np.arange(self.nusers, dtype=np.int32), self.user_counts())
+
+    def coo(self):
+        self.compact()
+        return self.user_ids(), self.indices, self.values
+
+    def total(self):
+        if self._sum is None:
+            self.compact()
+            self._sum = float(self.values.sum(dtype=np.float64))
+        return self._sum
+
+    def compact(self):
+        if not self._compact:
+            self._repack(slack=False)
+            self._compact = True
+
+    def _repack(self, slack):
+        # lay the segments out in id order again. with slack every movie
+        # segment keeps room to grow, so the next updates can stay in place
+        nu, nm = self.nusers, self.nmovies
+        pos = _positions(self.ustart[:nu], self.ucount[:nu])
+        self.indices = self.indices[pos]
+        self.values = self.values[pos]
+        self.ucount = self.ucount[:nu].copy()
+        self.ustart = _counts_to_indptr(self.ucount)[:-1]
+        self.ucap = self.ucount.copy()
+        self._uend = self._nnz
+
+        self.mcount = self.mcount[:nm].copy()
+        self.mcap = self.mcount + (self.mcount // 8 + 4 if slack else 0)
+        mstart = _counts_to_indptr(self.mcap)
+        pos = _positions(self.mstart[:nm], self.mcount)
+        dest = _positions(mstart[:-1], self.mcount)
+        mindices = np.zeros(mstart[-1], dtype=np.int32)
+        mvalues = np.zeros(mstart[-1], dtype=self.dtype)
+        mindices[dest] = self.mindices[pos]
+        mvalues[dest] = self.mvalues[pos]
+        self.mindices, self.mvalues = mindices, mvalues
+        self.mstart = mstart[:-1]
+        self._mend = int(mstart[-1])
+
+    def copy(self):
+        self.compact()
+        obj = RatingStorage.from_csr(
+            self.nusers,
+            self.nmovies,
+            self.indptr,
+            self.indices.copy(),
+            self.values.copy(),
+            self.mindptr,
+            self.mindices.copy(),
+            self.mvalues.copy(),
+        )
+        obj._sum = self._sum
+        return obj
+
+    def astype(self, dtype):
+        obj = self.copy()
+        obj.values = obj.values.astype(dtype)
+        obj.mvalues = obj.mvalues.astype(dtype)
+        obj._sum = None
+        return obj
+
+    def resize(self, nusers, nmovies):
+        # grow the id ranges, new users and movies have no ratings
+        if nusers > self.nusers:
+            for name in ("ustart", "ucount", "ucap"):
+                setattr(self, name, _grow(getattr(self, name), nusers))
+            self.nusers = nusers
+        if nmovies > self.nmovies:
+            for name in ("mstart", "mcount", "mcap"):
+                setattr(self, name, _grow(getattr(self, name), nmovies))
+            self.nmovies = nmovies
+
+    def _make_writable(self, dtype):
+        # memory mapped snapshots are read-only and ratings that do not fit
+        # the current dtype need a wider one, both cost a single copy
+        dtype = np.promote_types(self.dtype, dtype)
+        if dtype != self.dtype or not self.values.flags.writeable:
+            self.indices = self.indices.copy()
+            self.values = self.values.astype(dtype)
+            self.mindices = self.mindices.copy()
+            self.mvalues = self.mvalues.astype(dtype)
+        for name in ("ustart", "ucount", "ucap", "mstart", "mcount", "mcap"):
+            if not getattr(self, name).flags.writeable:
+                setattr(self, name, getattr(self, name).copy())
+
+    def _user_alloc(self, size):
+        start = self._uend
+        self.indices = _grow(self.indices, start + size)
+        self.values = _grow(self.values, start + size)
+        self._uend += size
+        return start
+
+    def set_user(self, uid, mids, ratings):
+        # replace all ratings of a user, mids must be sorted and unique.
+        # costs O(ratings of the user) plus a shift inside every movie
+        # segment that changes; both views and the running sum stay in sync
+        from recsys.fast_methods import _fast_update_movie_segments
+
+        mids = np.asarray(mids, dtype=np.int32)
+        ratings = np.asarray(ratings)
+        self.total()
+        self._make_writable(rating_dtype(ratings))
+        ratings = ratings.astype(self.dtype)
+        self._compact = False
+
+        old_mids, old_ratings = (x.copy() for x in self.user(uid))
+        removed = np.setdiff1d(old_mids, mids, assume_unique=True)
+        added = mids[np.isin(mids, old_mids, assume_unique=True, invert=True)]
+        # full movie segments move to the end of the buffer with twice the
+        # capacity, reserve that room up front
+        full = added[self.mcount[added] == self.mcap[added]]
+        size = self._mend + int(np.maximum(4, 2 * self.mcount[full]).sum())
+        self.mindices = _grow(self.mindices, size)
+        self.mvalues = _grow(self.mvalues, size)
+        self._mend = _fast_update_movie_segments(
+            self.mstart,
+            self.mcount,
+            self.mcap,
+            self.mindices,
+            self.mvalues,
+            self._mend,
+            uid,
+            removed,
+            mids,
+            ratings,
+        )
+
+        n = len(mids)
+        if n > self.ucap[uid]:
+            self.ustart[uid] = self._user_alloc(n)
+            self.ucap[uid] = n
+        start = self.ustart[uid]
+        self.indices[start : start + n] = mids
+        self.values[start : start + n] = ratings
+        self.ucount[uid] = n
+
+        self._nnz += n - len(old_mids)
+        self._sum += float(ratings.sum(dtype=np.float64))
+        self._sum -= float(old_ratings.sum(dtype=np.float64))
+        # space of moved segments is dead until the next repack
+        udead = self._uend - self.ucap[: self.nusers].sum()
+        mdead = self._mend - self.mcap[: self.nmovies].sum()
+        if udead + mdead > self._nnz + 1024:
+            self._repack(slack=True)
+
+    def take_movies(self, keep):
+        # keep the movies in the boolean mask and renumber them to 0..n-1
+        # preserving their order, in O(nnz)
+        self.compact()
+        newmid = np.cumsum(keep, dtype=np.int64) - 1
+        entries = keep[self.indices]
+        uids = self.user_ids()[entries]
+        # the movie-major view only loses whole segments, no resort needed
+        mentries = np.repeat(keep, self.movie_counts())
+        return RatingStorage.from_csr(
+            self.nusers,
+            int(keep.sum()),
+            _counts_to_indptr(np.bincount(uids, minlength=self.nusers)),
+            newmid[self.indices[entries]].astype(np.int32),
+            self.values[entries],
+            _counts_to_indptr(self.movie_counts()[keep]),
+            self.mindices[mentries],
+            self.mvalues[mentries],
+        )
+
+    def take_users(self, keep):
+        # the user counterpart of take_movies
+        self.compact()
+        newuid = np.cumsum(keep, dtype=np.int64) - 1
+        entries = np.repeat(keep, self.user_counts())
+        indices = self.indices[entries]
+        mentries = keep[self.mindices]
+        return RatingStorage.from_csr(
+            int(keep.sum()),
+            self.nmovies,
+            _counts_to_indptr(self.user_counts()[keep]),
+            indices,
+            self.values[entries],
+            _counts_to_indptr(np.bincount(indices, minlength=self.nmovies)),
+            newuid[self.mindices[mentries]].astype(np.int32),
+            self.mvalues[mentries],
+        )
+
+    def nbytes(self):
+        return sum(
+            getattr(self, name).nbytes
+            for name in ("indices", "values", "mindices", "mvalues")
+        ) + 3 * 8 * (self.nusers + self.nmovies)
@@ -1,7 +1,10 @@
+import hashlib
 import pickle
 import json
 import numpy as np
-from recsys.fast_methods import _fast_foreign_train, _fast_cv
+from recsys.als import _fold_in, _normal_equations
+from recsys.similarity import SimilarityIndex
+from recsys.snapshot import read_model, write_model
 
 
 class TrainedModel:
@@ -12,6 +15,9 @@ class TrainedModel:
         self._lr = None
         self._reg = None
         self._global_mean = None
+        self._index_cache = None
+        self._similarity = None
+        self._version = None
         if recsys is not None:
             self._M = recsys._M.copy()
             self._b = recsys._movie_bias.copy()
@@ -35,6 +41,15 @@ class TrainedModel:
         model._global_mean = data["gm"]
         return model
 
+    @classmethod
+    def read_binary(cls, path: str) -> "TrainedModel":
+        # memory maps a model snapshot, see recsys.snapshot. The arrays are
+        # read-only views of the file, shared between processes
+        return read_model(path, cls)
+
+    def to_binary(self, path: str):
+        write_model(self, path)
+
     @staticmethod
     def load_pkl(filename):
         f = open(filename, "rb")
@@ -47,6 +62,8 @@ class TrainedModel:
         model._lr = d["lr"]
         model._reg = d["reg"]
         model._global_mean = d["gm"]
+        if "similar" in d:
+            model._similarity = SimilarityIndex.from_arrays(*d["similar"])
         return model
 
     def pickle(self, filename):
@@ -57,10 +74,27 @@ class TrainedModel:
         d["lr"] = self._lr
         d["reg"] = self._reg
         d["gm"] = self._global_mean
+        if self._similarity is not None and self._similarity.k:
+            d["similar"] = (
+                self._similarity._vectors,
+                self._similarity._neighbours,
+                self._similarity._scores,
+            )
         f = open(filename, "wb")
         pickle.dump(d, f)
         f.close()
 
+    @property
+    def version(self):
+        # hash of the parameters, identifies the model in stored user vectors
+        if self._version is None:
+            h = hashlib.blake2b(digest_size=8)
+            for array in (self._M, self._b):
+                h.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+            h.update(np.array([self._global_mean, self._reg], dtype=np.float64))
+            self._version = h.hexdigest()
+        return self._version
+
     @property
     def nf(self):
         return self._M.shape[1]
@@ -70,14 +104,71 @@ class TrainedModel:
             if movie in self._movie_indices:
                 yield self._movie_indices[movie], rating
 
-    def cv(self, data, folds):
-        trainset = np.array(list(self.trainset_gen(data)))
-        print(trainset)
-        return _fast_cv(
-            trainset, self._b, self._M, self._global_mean, folds, self._lr, self._reg
-        )
+    def cv(self, data, folds=5, exact=True, epochs=200, seed=None):
+        # rmse and mae of k-fold cross validation of the fold-in over the
+        # known ratings of data, folds come from one shuffled index array.
+        # exact=True validates the ridge solve of train, where every fold
+        # removes its test ratings from the normal equations of all
+        # ratings; exact=False the SGD fold-in, with the folds in parallel
+        mids, ratings = self._trainset_arrays(data)
+        N = len(mids)
+        if folds < 2 or N < folds:
+            raise ValueError("cross validation needs 2 folds and a rating per fold")
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(N)
+        bounds = np.arange(folds + 1) * N // folds
+        if exact:
+            errors = self._exact_cv(mids, ratings, order, bounds)
+        else:
+            from recsys.fast_methods import _fast_cv
+
+            errors = _fast_cv(
+                mids,
+                ratings,
+                order,
+                bounds,
+                rng.normal(0, 0.1, folds),
+                rng.normal(0, 0.1, (folds, self.nf)),
+                self._b,
+                self._M,
+                self._global_mean,
+                self._lr,
+                self._reg,
+                epochs,
+            )
+        squared, absolute, tested = errors.sum(axis=0)
+        return np.sqrt(squared / tested), absolute / tested
+
+    def _exact_cv(self, mids, ratings, order, bounds):
+        target = ratings - self._global_mean - self._b[mids]
+        G, rhs = _normal_equations(self._M[mids], target)
+        errors = np.zeros((len(bounds) - 1, 3))
+        for f, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            test = order[lo:hi]
+            Gt, rhst = _normal_equations(self._M[mids[test]], target[test])
+            n = len(mids) - len(test)
+            A = G - Gt + self._reg * n * np.eye(len(rhs))
+            x = np.linalg.solve(A, rhs - rhst)
+            err = target[test] - x[0] - self._M[mids[test]] @ x[1:]
+            errors[f] = (err**2).sum(), np.abs(err).sum(), len(test)
+        return errors
+
+    def _trainset_arrays(self, data):
+        mids, ratings = [], []
+        for mid, rating in self.trainset_gen(data):
+            mids.append(mid)
+            ratings.append(rating)
+        return np.array(mids, dtype=np.int64), np.array(ratings, dtype=np.float64)
+
+    def train(self, data, exact=True):
+        # exact solves the regularized least squares problem for the bias and
+        # factors of the user directly; exact=False runs the old 200 epochs
+        # of SGD from a random start
+        if exact:
+            Ns, biases, U = self.train_batch([data])
+            return Ns[0], biases[0], U[0]
+        from recsys.fast_methods import _fast_foreign_train
 
-    def train(self, data):
         trainset = np.array(list(self.trainset_gen(data)))
         N = len(trainset)
         bias, U = _fast_foreign_train(
@@ -95,13 +186,81 @@ class TrainedModel:
         )
         return N, bias, U
 
-    def recommend(self, bias, U, exclude):
+    def train_batch(self, datas):
+        # exact fold-in of many users at once, returns the number of known
+        # ratings, the bias and the factor vector of every user
+        arrays = [self._trainset_arrays(data) for data in datas]
+        Ns = np.array([len(mids) for mids, _ in arrays])
+        indptr = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum(Ns, out=indptr[1:])
+        biases, U = _fold_in(
+            indptr,
+            np.concatenate([mids for mids, _ in arrays]),
+            np.concatenate([ratings for _, ratings in arrays]),
+            self._b,
+            self._M,
+            self._global_mean,
+            self._reg,
+        )
+        return Ns, biases, U
+
+    def _movie_arrays(self):
+        # names in index order and the rank of every index in the iteration
+        # order of _movie_indices, which decides ties in recommend
+        if self._index_cache is None or self._index_cache[0] is not self._movie_indices:
+            names = np.empty(len(self._movie_indices), dtype=object)
+            rank = np.empty(len(self._movie_indices), dtype=np.int64)
+            for i, (movie, idx) in enumerate(self._movie_indices.items()):
+                names[idx] = movie
+                rank[idx] = i
+            self._index_cache = (self._movie_indices, names, rank)
+        return self._index_cache[1:]
+
+    def exclude_mask(self, movies):
+        mask = np.zeros(len(self._movie_indices), dtype=bool)
+        mask[
+            [self._movie_indices[m] for m in movies if m in self._movie_indices]
+        ] = True
+        return mask
+
+    def recommend(self, bias, U, exclude, k=None):
+        # the k best predictions as (movie, prediction) pairs, best first.
+        # exclude is an iterable of movies or a mask from exclude_mask
+        names, rank = self._movie_arrays()
+        if not isinstance(exclude, np.ndarray):
+            exclude = self.exclude_mask(exclude)
         predictions = self._global_mean + bias + U.dot(self._M.transpose()) + self._b
         predictions = np.minimum(np.maximum(predictions, 1), 10)
-        predictions = {
-            movie: predictions[self._movie_indices[movie]]
-            for movie in self._movie_indices
-            if not movie in exclude
-        }
-        predictions = sorted(predictions.items(), key=lambda x: x[1], reverse=True)
-        return predictions
+        candidates = np.flatnonzero(~exclude)
+        scores = predictions[candidates]
+        if k is not None and k < len(candidates):
+            # keep everything tied with the k-th best, ties are broken below
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+            keep = scores >= kth
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.lexsort((rank[candidates], -scores))[:k]
+        return list(zip(names[candidates[order]].tolist(), scores[order].tolist()))
+
+    def build_similarity_index(self, k=50):
+        # precomputes the k most similar movies of every movie
+        self._similarity = SimilarityIndex(self._M, k)
+
+    def similar_movies(self, movies, k=10):
+        # (movie, cosine similarity) pairs of the k most similar movies, for
+        # one movie or a list for every movie in a list of movies
+        if self._similarity is None:
+            self._similarity = SimilarityIndex(self._M)
+        names, _ = self._movie_arrays()
+        single = isinstance(movies, str)
+        if single:
+            movies = [movies]
+        for movie in movies:
+            if movie not in self._movie_indices:
+                raise ValueError("Movie {} not in data".format(movie))
+        neighbours, scores = self._similarity.query(
+            [self._movie_indices[m] for m in movies], k
+        )
+        result = [
+            list(zip(names[n].tolist(), s.tolist())) for n, s in zip(neighbours, scores)
+        ]
+        return result[0] if single else result
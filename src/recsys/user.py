@@ -12,14 +12,12 @@ class User:
         return self._rm._uid.inverse[self._id]
 
     def ratings(self):
-        return self._rm._data.get(self._id, {})
+        mids, ratings = self._rm._storage.user(self._id)
+        return dict(zip(mids.tolist(), ratings.tolist()))
 
     def watched(self):
-        return len(self.ratings())
+        return len(self._rm._storage.user(self._id)[0])
 
     def mean(self):
-        m, i = 0, 0
-        for mid, r in self.ratings().items():
-            m += r
-            i += 1
-        return m / i
+        _, ratings = self._rm._storage.user(self._id)
+        return float(ratings.sum(dtype=float)) / len(ratings)
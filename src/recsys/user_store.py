@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from recsys.als import _normal_equations
+
+
+class _Entry:
+    def __init__(self, mids, ratings, G, rhs, bias, U):
+        self.mids = mids
+        self.ratings = ratings
+        self.G = G
+        self.rhs = rhs
+        self.bias = bias
+        self.U = U
+
+    @property
+    def nbytes(self):
+        return sum(
+            x.nbytes for x in (self.mids, self.ratings, self.G, self.rhs, self.U)
+        )
+
+
+class UserVectorStore:
+    # folded-in bias and factors of users, kept per username for one model
+    # version. Unchanged ratings return the stored vector, changed ratings
+    # update the stored normal equations with the changed entries only and
+    # solve again, which gives the same result as TrainedModel.train. The
+    # least recently used users are dropped beyond max_entries or max_bytes,
+    # and all users are dropped when a model with another version is used
+    def __init__(self, max_entries=10000, max_bytes=256 * 2**20):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, username):
+        return username in self._entries
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+    def _arrays(self, model, data):
+        mids, ratings = model._trainset_arrays(data)
+        order = np.argsort(mids, kind="stable")
+        return mids[order], ratings[order]
+
+    def _equations(self, model, mids, ratings):
+        target = ratings - model._global_mean - model._b[mids]
+        return _normal_equations(model._M[mids], target)
+
+    def _solve(self, model, G, rhs, n):
+        if n == 0:
+            return 0.0, np.zeros(model.nf)
+        A = G + model._reg * n * np.eye(len(rhs))
+        x = np.linalg.solve(A, rhs)
+        return x[0], x[1:]
+
+    def _update(self, model, entry, mids, ratings):
+        # entries that were removed or changed leave the equations, new and
+        # changed ones enter them. A large change is solved from scratch
+        common, old_at, new_at = np.intersect1d(
+            entry.mids, mids, assume_unique=True, return_indices=True
+        )
+        kept_old = np.zeros(len(entry.mids), dtype=bool)
+        kept_new = np.zeros(len(mids), dtype=bool)
+        same = entry.ratings[old_at] == ratings[new_at]
+        kept_old[old_at[same]] = True
+        kept_new[new_at[same]] = True
+        removed, added = ~kept_old, ~kept_new
+        if removed.sum() + added.sum() > len(mids) // 2:
+            return self._equations(model, mids, ratings)
+        G, rhs = entry.G.copy(), entry.rhs.copy()
+        dG, drhs = self._equations(model, entry.mids[removed], entry.ratings[removed])
+        G -= dG
+        rhs -= drhs
+        dG, drhs = self._equations(model, mids[added], ratings[added])
+        G += dG
+        rhs += drhs
+        return G, rhs
+
+    def fold_in(self, model, username, data):
+        # same return value as TrainedModel.train: number of known ratings,
+        # bias and factor vector. The lock only guards the entries, the
+        # equations are updated and solved outside of it; entries are never
+        # changed in place
+        mids, ratings = self._arrays(model, data)
+        version = model.version
+        with self._lock:
+            if self._version != version:
+                self.clear()
+                self._version = version
+            entry = self._entries.get(username)
+            if entry is not None:
+                self._entries.move_to_end(username)
+                if np.array_equal(entry.mids, mids) and np.array_equal(
+                    entry.ratings, ratings
+                ):
+                    return len(mids), entry.bias, entry.U
+        if entry is not None:
+            G, rhs = self._update(model, entry, mids, ratings)
+        else:
+            G, rhs = self._equations(model, mids, ratings)
+        bias, U = self._solve(model, G, rhs, len(mids))
+        with self._lock:
+            # a model with another version may have been used meanwhile
+            if self._version == version:
+                old = self._entries.pop(username, None)
+                if old is not None:
+                    self._nbytes -= old.nbytes
+                self._insert(username, _Entry(mids, ratings, G, rhs, bias, U))
+        return len(mids), bias, U
+
+    def _insert(self, username, entry):
+        self._entries[username] = entry
+        self._nbytes += entry.nbytes
+        while self._entries and (
+            len(self._entries) > self._max_entries or self._nbytes > self._max_bytes
+        ):
+            _, dropped = self._entries.popitem(last=False)
+            self._nbytes -= dropped.nbytes
@@ -0,0 +1,97 @@
+import http.server
+import os
+import threading
+
+# saved films list pages, fixtures/<username>/films/page/<n>.html
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    # serves pages[path] when a test set it, otherwise the fixture of the
+    # path and 404 for everything else. Query strings are ignored, every
+    # requested path is recorded
+    protocol_version = "HTTP/1.1"
+    pages = {}
+    requested = []
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.requested.append(path)
+        body = self.pages.get(path)
+        fixture = os.path.normpath(os.path.join(FIXTURES, path.strip("/")))
+        if body is None and fixture.startswith(FIXTURES):
+            if os.path.isfile(fixture + ".html"):
+                with open(fixture + ".html", "rb") as f:
+                    body = f.read()
+        if body is None:
+            self.send_response(404)
+            body = b"not found"
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def reset(cls):
+        cls.pages.clear()
+        cls.requested.clear()
+
+
+def start(*variables):
+    # starts a stand-in and points the environment variables at it, returns
+    # a function that stops it again
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    previous = {name: os.environ.get(name) for name in variables}
+    for name in variables:
+        os.environ[name] = "http://127.0.0.1:{}".format(server.server_port)
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+    return stop
+
+
+def _poster(slug, rating):
+    stars = ""
+    if rating:
+        stars = '<span class="rating -micro -darker rated-{}"> * </span>'.format(rating)
+    return (
+        '<li class="poster-container"><div class="really-lazy-load poster '
+        'film-poster linked-film-poster" data-target-link="/film/{}/"></div>'
+        '<p class="poster-viewingdata">{}</p></li>'.format(slug, stars)
+    )
+
+
+def set_films(username, films, per_page=6):
+    # serves films, a list of (slug, rating) with the most recently added
+    # first and 0 or None for unrated films, as the films list pages of
+    # username; returns the number of pages
+    pages = [films[i : i + per_page] for i in range(0, len(films), per_page)]
+    for page, chunk in enumerate(pages or [[]], 1):
+        pagination = ""
+        if len(pages) > 1:
+            pagination = '<div class="paginate-pages"><ul>{}</ul></div>'.format(
+                "".join(
+                    '<li class="paginate-page"><a href="/{0}/films/page/{1}/">'
+                    "{1}</a></li>".format(username, i)
+                    for i in range(1, len(pages) + 1)
+                    if i != page
+                )
+            )
+        posters = "".join(_poster(slug, rating) for slug, rating in chunk)
+        body = "<html><body><ul class='poster-list'>{}</ul>{}</body></html>".format(
+            posters, pagination
+        )
+        StandIn.pages["/{}/films/page/{}".format(username, page)] = body.encode()
+    return len(pages)
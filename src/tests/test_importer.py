@@ -0,0 +1,149 @@
+import json
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+
+from myapp import db
+from myapp.db_models import Director, Genre, Movie, movie_genres
+from myapp.importer import MovieImporter
+from tests.stand_in import StandIn, start
+
+
+def setUpModule():
+    # the letterboxd film pages and the tmdb api are served by one stand-in
+    global stop, previous_key
+    stop = start("LETTERBOXD_URL", "TMDB_URL")
+    previous_key = os.environ.get("TMDB_API_KEY")
+    os.environ["TMDB_API_KEY"] = "test"
+
+
+def tearDownModule():
+    stop()
+    if previous_key is None:
+        del os.environ["TMDB_API_KEY"]
+    else:
+        os.environ["TMDB_API_KEY"] = previous_key
+
+
+def set_movie(link, tmdb, genres=((1, "Drama"),), directors=((1, "Someone"),)):
+    # the letterboxd film page with the tmdb id and the tmdb details with
+    # credits of a movie
+    StandIn.pages[
+        "/film/{}".format(link)
+    ] = '<html><body data-tmdb-id="{}"></body></html>'.format(tmdb).encode()
+    StandIn.pages["/movie/{}".format(tmdb)] = json.dumps(
+        {
+            "title": link.title(),
+            "original_title": link,
+            "release_date": "2001-02-03",
+            "poster_path": "/{}.jpg".format(link),
+            "overview": "",
+            "genres": [{"id": i, "name": name} for i, name in genres],
+            "credits": {
+                "crew": [
+                    {"id": i, "name": name, "job": "Director"} for i, name in directors
+                ]
+                + [{"id": 999, "name": "Writer", "job": "Screenplay"}]
+            },
+        }
+    ).encode()
+
+
+class MovieImporterTest(unittest.TestCase):
+    def setUp(self):
+        StandIn.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///{}".format(
+            os.path.join(self.directory.name, "data.db")
+        )
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        # executemany calls per table
+        self.inserts = []
+        event.listen(db.engine, "before_cursor_execute", self.record)
+
+        self.links = ["movie-{}".format(i) for i in range(8)]
+        for i, link in enumerate(self.links):
+            set_movie(link, i + 1, directors=((i % 3, "Director {}".format(i % 3)),))
+        set_movie("documentary", 50, genres=((2, "Documentary"),))
+        self.links.append("documentary")
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self.record)
+        db.session.remove()
+        self.context.pop()
+        self.directory.cleanup()
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT") and executemany:
+            self.inserts.append(statement.split()[2])
+
+    def run_importer(self, links):
+        importer = MovieImporter(workers=4, batch=3)
+        progress = list(importer.run(links))
+        importer.write_reports(
+            os.path.join(self.directory.name, "log.txt"),
+            os.path.join(self.directory.name, "ignore.txt"),
+        )
+        with open(os.path.join(self.directory.name, "ignore.txt")) as f:
+            ignored = f.read().split()
+        return importer, progress, ignored
+
+    def stored(self):
+        return sorted(link for (link,) in db.session.query(Movie.letterboxd_link))
+
+    def test_batches(self):
+        importer, progress, ignored = self.run_importer(self.links)
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(self.stored(), sorted(self.links))
+        self.assertEqual(importer.errors, [])
+        # one bulk insert of the movies per batch
+        self.assertEqual(self.inserts.count("movies"), 3)
+        self.assertEqual(db.session.query(Director).count(), 3)
+        self.assertEqual(db.session.query(Genre).count(), 1)
+        # ignored movies are stored without genres and directors
+        self.assertEqual(db.session.query(movie_genres).count(), 8)
+        self.assertEqual(ignored, ["documentary"])
+        movie = db.session.get(Movie, "movie-4")
+        self.assertEqual((movie.tmdb, movie.year), (5, 2001))
+        self.assertEqual(movie.director_string(), "Director 1")
+
+    def test_rerun(self):
+        # movie-2 fails on tmdb and is retried by the next run, the movies
+        # that were added are not fetched again
+        del StandIn.pages["/movie/3"]
+        importer, _, ignored = self.run_importer(self.links)
+        self.assertEqual([link for link, _ in importer.errors], ["movie-2"])
+        self.assertNotIn("movie-2", self.stored())
+        self.assertEqual(ignored, ["documentary", "movie-2"])
+
+        set_movie("movie-2", 3)
+        StandIn.requested.clear()
+        importer, progress, ignored = self.run_importer(self.links)
+        self.assertEqual(importer.added, ["movie-2"])
+        self.assertEqual(len(progress), 1)
+        self.assertEqual(sorted(StandIn.requested), ["/film/movie-2", "/movie/3"])
+        self.assertEqual(self.stored(), sorted(self.links))
+        self.assertEqual(ignored, ["documentary"])
+
+    def test_duplicate_tmdb_id(self):
+        # the second link of the same tmdb movie is an error, the rest of
+        # its batch is written
+        set_movie("movie-1-copy", 2)
+        links = ["movie-0", "movie-1", "movie-1-copy", "movie-3"]
+        importer, _, ignored = self.run_importer(links)
+        self.assertEqual([link for link, _ in importer.errors], ["movie-1-copy"])
+        self.assertIn("tmdb id 2", str(importer.errors[0][1]))
+        self.assertEqual(self.stored(), ["movie-0", "movie-1", "movie-3"])
+        self.assertEqual(ignored, ["movie-1-copy"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import initial_scrape
+import letterboxd_scrape.methods as methods
+from letterboxd_scrape import RatingsCache
+from letterboxd_scrape.parse import parse_page, parse_page_count
+from tests.stand_in import FIXTURES, StandIn, set_films, start
+
+ALICE = {
+    "the-godfather": 4,
+    "parasite-2019": 1,
+    "spirited-away": 5,
+    "whiplash-2014": 9,
+    "fight-club": 7,
+    "interstellar": 4,
+    "la-la-land": 8,
+    "get-out-2017": 7,
+    "her": 2,
+    "call-me-by-your-name": 5,
+    "lady-bird": 5,
+    "in-the-mood-for-love": 2,
+    "taxi-driver": 7,
+    "goodfellas": 5,
+    "arrival-2016": 8,
+    "there-will-be-blood": 2,
+    "fargo": 9,
+    "the-grand-budapest-hotel": 9,
+    "blade-runner-2049": 8,
+}
+BOB = {"the-godfather": 4, "parasite-2019": 1, "spirited-away": 5, "whiplash-2014": 9}
+
+
+def read_fixture(username, page):
+    path = os.path.join(FIXTURES, username, "films", "page", "{}.html".format(page))
+    with open(path, "rb") as f:
+        return parse_page(f.read())
+
+
+def setUpModule():
+    # letterboxd_scrape reads LETTERBOXD_URL on every call, so it does not
+    # matter that it was imported before
+    global stop
+    stop = start("LETTERBOXD_URL")
+
+
+def tearDownModule():
+    stop()
+
+
+class GetRatingsAsyncTest(unittest.TestCase):
+    def setUp(self):
+        StandIn.reset()
+
+    def test_page_count(self):
+        # the first page links pages 1 to 3 and the last one
+        self.assertEqual(parse_page_count(read_fixture("alice", 1)), 5)
+        # a list that fits on one page has no pagination
+        self.assertEqual(parse_page_count(read_fixture("bob", 1)), 1)
+
+    def test_fetches_every_page_once(self):
+        ratings = asyncio.run(methods.get_ratings_async("alice", concurrency=2))
+        self.assertEqual(ratings, ALICE)
+        self.assertEqual(
+            sorted(StandIn.requested),
+            ["/alice/films/page/{}".format(i) for i in range(1, 6)],
+        )
+
+    def test_matches_serial(self):
+        serial = {}
+        for i in range(1, 6):
+            serial.update(
+                methods._get_ratings_from_link(methods.films_link("alice", i))
+            )
+        self.assertEqual(methods.get_ratings("alice"), serial)
+
+    def test_single_page(self):
+        ratings = methods.get_ratings("bob")
+        self.assertEqual(ratings, BOB)
+        self.assertEqual(StandIn.requested, ["/bob/films/page/1"])
+
+    def test_unknown_user(self):
+        self.assertEqual(methods.get_ratings("nobody"), 404)
+        self.assertEqual(StandIn.requested, ["/nobody/films/page/1"])
+
+
+def films(prefix, n, rating=None):
+    # n films named prefix-<i>, rated rating or 1 to 10 when rating is None
+    return [
+        ("{}-{}".format(prefix, i), rating if rating is not None else i % 10 + 1)
+        for i in range(n)
+    ]
+
+
+def rated(films):
+    return {slug: rating for slug, rating in films if rating}
+
+
+class RatingsCacheTest(unittest.TestCase):
+    def setUp(self):
+        StandIn.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = RatingsCache(os.path.join(self.directory.name, "cache"))
+        self.old = films("old", 10) + films("unrated", 20, 0) + films("rest", 5)
+        set_films("carol", self.old)
+        self.assertEqual(self.cache.get_ratings("carol"), rated(self.old))
+        self.assertIn("carol", self.cache)
+        StandIn.requested.clear()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def refresh(self, films):
+        # serves films and refreshes the cached ratings of carol, returns
+        # the ratings and the pages requested
+        npages = set_films("carol", films)
+        StandIn.requested.clear()
+        self.cache._ttl = 0
+        ratings = self.cache.get_ratings("carol")
+        self.assertEqual(self.cache.load("carol"), ratings)
+        return (
+            ratings,
+            sorted(int(path.split("/")[-1]) for path in StandIn.requested),
+            npages,
+        )
+
+    def test_directory_created_on_store(self):
+        cache = RatingsCache(os.path.join(self.directory.name, "other"))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "other")))
+        self.assertIsNone(cache.load("carol"))
+
+    def test_fresh_within_ttl(self):
+        set_films("carol", films("new", 3) + self.old)
+        self.assertEqual(self.cache.get_ratings("carol"), rated(self.old))
+        self.assertEqual(StandIn.requested, [])
+
+    def test_full_scrape(self):
+        new = films("new", 3) + self.old
+        set_films("carol", new)
+        self.assertEqual(self.cache.get_ratings("carol", full=True), rated(new))
+        self.assertEqual(len(StandIn.requested), 7)
+
+    def test_refresh_stops_at_known_page(self):
+        new = films("new", 3) + self.old
+        ratings, pages, npages = self.refresh(new)
+        self.assertEqual(ratings, rated(new))
+        self.assertEqual((pages, npages), ([1, 2], 7))
+
+    def test_refresh_with_new_unrated_films(self):
+        # pages with unrated films only are walked until a known rating
+        new = films("watched", 14, 0) + self.old
+        ratings, pages, npages = self.refresh(new)
+        self.assertEqual(ratings, rated(self.old))
+        self.assertEqual((pages, npages), ([1, 2, 3], 9))
+
+    def test_refresh_stops_on_unrated_page(self):
+        # a new rating above a stretch of unrated films stops on the first
+        # unrated page after a known rating
+        new = [("new", 7)] + films("old", 3) + films("unrated", 30, 0) + films("old", 3)
+        set_films("carol", films("old", 3) + films("unrated", 30, 0))
+        self.cache.store("carol", rated(films("old", 3)))
+        ratings, pages, npages = self.refresh(new)
+        self.assertEqual(ratings, dict(rated(films("old", 3)), new=7))
+        self.assertEqual((pages, npages), ([1, 2], 7))
+
+    def test_changed_rating(self):
+        new = [(slug, 10 if slug == "old-1" else r) for slug, r in self.old]
+        ratings, pages, npages = self.refresh(new)
+        self.assertEqual(ratings["old-1"], 10)
+        self.assertEqual(pages, [1, 2])
+
+    def test_deleted_user(self):
+        StandIn.pages.clear()
+        self.cache._ttl = 0
+        self.assertEqual(self.cache.get_ratings("carol"), 404)
+        self.assertNotIn("carol", self.cache)
+
+
+class MakeDataTest(unittest.TestCase):
+    def setUp(self):
+        StandIn.reset()
+        set_films("dave", films("film", 40))
+        set_films("erin", films("film", 5))
+
+    def make_data(self, directory, usernames):
+        with mock.patch.object(
+            initial_scrape, "get_username_list", return_value=usernames
+        ), contextlib.redirect_stdout(io.StringIO()):
+            initial_scrape.make_data(directory)
+
+    def test_resume(self):
+        # users already in the folder are skipped, users with too few
+        # ratings and unknown users are not stored
+        with tempfile.TemporaryDirectory() as directory:
+            RatingsCache(directory).store("alice", {"film-1": 3})
+            self.make_data(directory, ["alice", "dave", "erin", "nobody"])
+            cache = RatingsCache(directory)
+            self.assertEqual(cache.load("alice"), {"film-1": 3})
+            self.assertEqual(cache.load("dave"), rated(films("film", 40)))
+            self.assertNotIn("erin", cache)
+            self.assertNotIn("nobody", cache)
+            self.assertFalse(any(p.startswith("/alice/") for p in StandIn.requested))
+
+            StandIn.requested.clear()
+            self.make_data(directory, ["alice", "dave"])
+            self.assertEqual(StandIn.requested, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
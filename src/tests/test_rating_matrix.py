@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from recsys.rating_matrix import RatingMatrix
+
+
+class ReadCsvTest(unittest.TestCase):
+    def test_matches_datapoints(self):
+        rng = np.random.default_rng(0)
+        lines = [
+            (int(u), int(m), int(r))
+            for u, m, r in zip(
+                rng.integers(0, 50, 2000),
+                rng.integers(0, 80, 2000),
+                rng.integers(1, 11, 2000),
+            )
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ratings.dat")
+            with open(path, "w") as f:
+                for u, m, r in lines:
+                    f.write("{}::{}::{}::0\n".format(u, m, r))
+            rm = RatingMatrix.read_csv(path)
+
+        expected = RatingMatrix()
+        for u, m, r in lines:
+            expected._add_datapoint("user{}".format(u), "movie{}".format(m), r)
+        self.assertEqual(len(rm._pending), 1)
+        self.assertEqual(dict(rm._uid), dict(expected._uid))
+        self.assertEqual(dict(rm._mid), dict(expected._mid))
+        for a, b in zip(rm._storage.coo(), expected._storage.coo()):
+            np.testing.assert_array_equal(a, b)
+        self.assertEqual(rm.global_mean(), expected.global_mean())
+
+
+def by_name(rm):
+    # votes, global mean and the ratings of every user and movie, keyed by
+    # names so that matrices with different ids compare equal
+    users, movies = rm._uid.inverse, rm._mid.inverse
+    return {
+        "votes": {movies[m]: n for m, n in rm.votes().items() if n},
+        "users": {
+            name: {movies[m]: r for m, r in rm.get_user(name).ratings().items()}
+            for name in rm._uid
+            if rm.get_user(name).watched()
+        },
+        "movies": {
+            name: {users[u]: r for u, r in rm.get_movie(name).ratings().items()}
+            for name in rm._mid
+            if rm.get_movie(name).votes()
+        },
+    }
+
+
+class UpsertTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.rng = rng
+        self.ratings = {
+            "user{}".format(u): {
+                "movie{}".format(m): int(rng.integers(1, 11))
+                for m in rng.choice(60, rng.integers(1, 30), replace=False)
+            }
+            for u in range(40)
+        }
+
+    def random_user(self):
+        movies = self.rng.choice(80, self.rng.integers(0, 40), replace=False)
+        return {"movie{}".format(m): int(self.rng.integers(1, 11)) for m in movies}
+
+    def check(self, rm):
+        expected = RatingMatrix()
+        for username, data in self.ratings.items():
+            if data:
+                expected.add_user_data(username, data)
+        self.assertAlmostEqual(rm.global_mean(), expected.global_mean(), places=12)
+        self.assertEqual(by_name(rm), by_name(expected))
+
+    def run_updates(self, rm):
+        for step in range(300):
+            username = "user{}".format(self.rng.integers(0, 60))
+            if step % 7 == 0 and username in rm._uid:
+                rm.delete_user(username)
+                self.ratings[username] = {}
+            else:
+                data = self.random_user()
+                if username in self.ratings and step % 3 == 0:
+                    # re-rate some known movies and keep the others
+                    data = dict(self.ratings[username], **data)
+                rm.upsert_user(username, data)
+                self.ratings[username] = data
+            if step % 50 == 0:
+                self.check(rm)
+        self.check(rm)
+
+    def test_upsert_and_delete(self):
+        rm = RatingMatrix()
+        for username, data in self.ratings.items():
+            rm.add_user_data(username, data)
+        self.run_updates(rm)
+
+    def test_upsert_on_snapshot(self):
+        # a snapshot is read-only until the first update
+        rm = RatingMatrix()
+        for username, data in self.ratings.items():
+            rm.add_user_data(username, data)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ratings.rms")
+            rm.to_snapshot(path)
+            rm = RatingMatrix.read_snapshot(path)
+            self.run_updates(rm)
+            del rm
+
+
+if __name__ == "__main__":
+    unittest.main()
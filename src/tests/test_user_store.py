@@ -0,0 +1,148 @@
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from recsys.trained import TrainedModel
+from recsys.user_store import UserVectorStore
+
+
+def make_model(seed=0, nmovies=120, nf=6):
+    rng = np.random.default_rng(seed)
+    model = TrainedModel()
+    model._movie_indices = {"movie{}".format(i): i for i in range(nmovies)}
+    model._M = rng.normal(0, 0.3, (nmovies, nf))
+    model._b = rng.normal(0, 0.2, nmovies)
+    model._lr = 0.001
+    model._reg = 0.02
+    model._global_mean = 3.5
+    return model
+
+
+def random_ratings(rng, n, nmovies=120):
+    return {
+        "movie{}".format(m): int(rng.integers(1, 11))
+        for m in rng.choice(nmovies, n, replace=False)
+    }
+
+
+class UserVectorStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.model = make_model()
+        self.store = UserVectorStore()
+        self.data = random_ratings(np.random.default_rng(1), 40)
+
+    def assert_folds_in(self, data, username="alice"):
+        # fold_in gives the vector of TrainedModel.train, and returns the
+        # sizes of the rating sets whose normal equations were computed
+        with mock.patch.object(
+            self.store, "_equations", wraps=self.store._equations
+        ) as equations:
+            N, bias, U = self.store.fold_in(self.model, username, data)
+        eN, ebias, eU = self.model.train(data)
+        self.assertEqual(N, eN)
+        self.assertAlmostEqual(bias, ebias, places=9)
+        np.testing.assert_allclose(U, eU, rtol=0, atol=1e-9)
+        return [len(call.args[1]) for call in equations.call_args_list]
+
+    def test_unchanged(self):
+        self.assertEqual(self.assert_folds_in(self.data), [40])
+        first = self.store.fold_in(self.model, "alice", self.data)
+        self.assertEqual(self.assert_folds_in(dict(self.data)), [])
+        self.assertIs(self.store.fold_in(self.model, "alice", self.data)[2], first[2])
+
+    def test_upsert(self):
+        self.assert_folds_in(self.data)
+        new = {m: 7 for m in ("movie0", "movie1", "movie2") if m not in self.data}
+        data = dict(self.data, **new)
+        # nothing leaves the equations, the new ratings enter them
+        self.assertEqual(self.assert_folds_in(data), [0, len(new)])
+
+    def test_rerating(self):
+        self.assert_folds_in(self.data)
+        data = dict(self.data)
+        for movie in list(data)[:3]:
+            data[movie] = data[movie] % 10 + 1
+        self.assertEqual(self.assert_folds_in(data), [3, 3])
+
+    def test_removal(self):
+        self.assert_folds_in(self.data)
+        data = dict(list(self.data.items())[4:])
+        self.assertEqual(self.assert_folds_in(data), [4, 0])
+
+    def test_unknown_movies(self):
+        self.assert_folds_in(self.data)
+        data = dict(self.data, unknown=5)
+        self.assertEqual(self.assert_folds_in(data), [])
+
+    def test_large_change(self):
+        # more changed than half of the ratings is solved from scratch
+        self.assert_folds_in(self.data)
+        data = random_ratings(np.random.default_rng(2), 30)
+        self.assertEqual(self.assert_folds_in(data), [30])
+
+    def test_empty(self):
+        N, bias, U = self.store.fold_in(self.model, "alice", {})
+        self.assertEqual((N, bias), (0, 0.0))
+        self.assertFalse(U.any())
+
+    def test_lru(self):
+        self.store = UserVectorStore(max_entries=2)
+        for username in ("a", "b"):
+            self.store.fold_in(self.model, username, self.data)
+        self.store.fold_in(self.model, "a", self.data)
+        self.store.fold_in(self.model, "c", self.data)
+        self.assertIn("a", self.store)
+        self.assertNotIn("b", self.store)
+        self.assertEqual(len(self.store), 2)
+
+    def test_max_bytes(self):
+        self.store.fold_in(self.model, "a", self.data)
+        size = self.store._nbytes
+        self.store = UserVectorStore(max_bytes=size * 2)
+        for username in ("a", "b", "c"):
+            self.store.fold_in(self.model, username, self.data)
+        self.assertEqual(list(self.store._entries), ["b", "c"])
+        self.assertEqual(self.store._nbytes, 2 * size)
+
+    def test_version_change(self):
+        self.store.fold_in(self.model, "a", self.data)
+        self.store.fold_in(self.model, "b", self.data)
+        self.model = make_model(seed=3)
+        self.assertEqual(self.assert_folds_in(self.data, "a"), [40])
+        self.assertEqual(len(self.store), 1)
+
+    def test_solve_outside_lock(self):
+        # a slow solve of one user does not block the fold-in of another
+        started, release = threading.Event(), threading.Event()
+        solve = self.store._solve
+
+        def slow_solve(model, G, rhs, n):
+            if n == 40:
+                started.set()
+                release.wait(10)
+            return solve(model, G, rhs, n)
+
+        with mock.patch.object(self.store, "_solve", slow_solve):
+            slow = threading.Thread(
+                target=self.store.fold_in, args=(self.model, "slow", self.data)
+            )
+            slow.start()
+            self.assertTrue(started.wait(10))
+            other = random_ratings(np.random.default_rng(4), 20)
+            fast = threading.Thread(
+                target=self.store.fold_in, args=(self.model, "fast", other)
+            )
+            fast.start()
+            fast.join(5)
+            finished = not fast.is_alive()
+            release.set()
+            slow.join()
+        self.assertTrue(finished)
+        self.assertIn("slow", self.store)
+        self.assertIn("fast", self.store)
+
+
+if __name__ == "__main__":
+    unittest.main()
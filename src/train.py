@@ -1,6 +1,11 @@
+import os
+
 from recsys import RatingMatrix, RecSys
+from recsys.snapshot import convert
 
-rm = RatingMatrix.read_json("raw_ratings.json")
+if not os.path.exists("raw_ratings.rms"):
+    convert("raw_ratings.json", "raw_ratings.rms")
+rm = RatingMatrix.read_snapshot("raw_ratings.rms")
 rm.filter(minvotes=50, inplace=True)
 
 